@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Measure parsing a signed <Response> with a new default parser each time
+against the hardened parser kept per thread.
+
+Run from the repository root:
+::
+    python benchmarks/parser.py
+"""
+import sys
+import timeit
+from os import path
+
+BASE_DIR = path.abspath(path.dirname(__file__))
+TESTS_DIR = path.join(BASE_DIR, '..', 'tests')
+sys.path.insert(0, path.join(BASE_DIR, '..'))
+
+from lxml import etree  # noqa
+from saml.schema import utils  # noqa
+
+
+def main(number=10000, repeat=5):
+    with open(path.join(TESTS_DIR, 'response-signed.xml'), 'rb') as stream:
+        text = stream.read()
+
+    for name, fn in [
+            ('etree.XML', lambda: etree.XML(text)),
+            ('utils.fromstring', lambda: utils.fromstring(text))]:
+        elapsed = min(timeit.repeat(fn, number=number, repeat=repeat))
+        print('%-20s %10.0f parses/s' % (name, number / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the time taken to peek at a large message posted with the
+HTTP-POST binding, compared with receiving (decoding and parsing) it
+whole.
+
+Run from the repository root:
+::
+    python benchmarks/peek.py
+"""
+import sys
+import timeit
+from os import path
+
+BASE_DIR = path.abspath(path.dirname(__file__))
+sys.path.insert(0, path.join(BASE_DIR, '..'))
+
+from saml import client  # noqa
+from receive import build_body  # noqa
+
+
+def main(number=200):
+    body = build_body()
+    print('body: %d bytes' % len(body))
+    for name, fn in [
+            ('client.receive', lambda: client.receive('POST', None, body)),
+            ('client.peek', lambda: client.peek('POST', None, body))]:
+        elapsed = timeit.timeit(fn, number=number) / number
+        print('%-20s %8.3f ms' % (name, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the peak memory allocated while receiving a large message posted
+with the HTTP-POST binding, compared with decoding the body as text and
+splitting it with `parse_qs` first.
+
+Run from the repository root:
+::
+    python benchmarks/receive.py
+"""
+import base64
+import sys
+import timeit
+import tracemalloc
+from os import path
+
+BASE_DIR = path.abspath(path.dirname(__file__))
+sys.path.insert(0, path.join(BASE_DIR, '..'))
+sys.path.insert(0, path.join(BASE_DIR, '..', 'tests'))
+
+from lxml import etree  # noqa
+from six.moves.urllib.parse import urlencode, parse_qs  # noqa
+from saml import client, schema  # noqa
+from test_schema import build_response_simple  # noqa
+
+
+def build_body(size=200 * 1024):
+    # Pad the response with attributes up to about `size` bytes.
+    response = build_response_simple()
+    xml = response.serialize()
+    namespace = schema.Assertion.meta.namespace[1]
+    statement = etree.SubElement(
+        xml[-1], '{%s}AttributeStatement' % namespace)
+    while len(etree.tostring(xml)) < size:
+        etree.SubElement(
+            statement, '{%s}Attribute' % namespace,
+            Name='urn:oid:2.5.4.42').text = 'x' * 64
+
+    text = base64.b64encode(etree.tostring(xml))
+    return urlencode([('SAMLResponse', text)]).encode('ascii')
+
+
+def receive_text(body):
+    # Receive the way it is done through text.
+    data = parse_qs(body.decode())
+    return etree.XML(base64.b64decode(data['SAMLResponse'][0]))
+
+
+def measure(fn, body):
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    elapsed = timeit.timeit(lambda: fn(body), number=50) / 50
+    return peak, elapsed
+
+
+def main():
+    body = build_body()
+    print('body: %d bytes' % len(body))
+    for name, fn in [
+            ('text + parse_qs', receive_text),
+            ('client.receive', lambda b: client.receive('POST', None, b)),
+            ('client.receive (memoryview)',
+             lambda b: client.receive('POST', None, memoryview(b)))]:
+        peak, elapsed = measure(fn, body)
+        print('%-30s peak %8d bytes  %8.3f ms' % (
+            name, peak, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
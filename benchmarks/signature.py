@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the throughput of signing and verifying a <Response> with each
+supported signature algorithm.
+
+Run from the repository root:
+::
+    python benchmarks/signature.py
+"""
+import sys
+import timeit
+from os import path
+
+BASE_DIR = path.abspath(path.dirname(__file__))
+TESTS_DIR = path.join(BASE_DIR, '..', 'tests')
+sys.path.insert(0, path.join(BASE_DIR, '..'))
+sys.path.insert(0, TESTS_DIR)
+
+from saml import signature  # noqa
+from test_schema import build_response_simple  # noqa
+
+KEYS = {
+    'rsa': ('rsa2key.pem', 'rsa2cert.pem'),
+    'ecdsa': ('ecdsakey.pem', 'ecdsacert.pem'),
+}
+
+
+def read(filename):
+    with open(path.join(TESTS_DIR, filename), 'rb') as stream:
+        return stream.read()
+
+
+def main(number=500):
+    response = build_response_simple()
+    print('%-14s %12s %12s' % ('algorithm', 'sign/s', 'verify/s'))
+    for algorithm in signature.SIGNATURE_ALGORITHMS:
+        key, certificate = KEYS[algorithm.split('-')[0]]
+        signer = signature.Signer(read(key), algorithm=algorithm)
+        verifier = signature.Verifier(read(certificate))
+
+        documents = [response.serialize() for _ in range(number)]
+        documents = iter(documents)
+        elapsed = timeit.timeit(
+            lambda: signer.sign(next(documents)), number=number)
+        sign_rate = number / elapsed
+
+        document = response.serialize()
+        signer.sign(document)
+        elapsed = timeit.timeit(
+            lambda: verifier.verify(document), number=number)
+        verify_rate = number / elapsed
+
+        print('%-14s %12.0f %12.0f' % (algorithm, sign_rate, verify_rate))
+
+
+if __name__ == '__main__':
+    main()
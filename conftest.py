@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+import sys
+
+# The asyncio support requires Python 3.7+; not even its syntax is
+# understood before 3.5.
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore += [
+        'saml/aio.py', 'saml/asgi.py',
+        'tests/test_aio.py', 'tests/test_asgi.py']
@@ -11,7 +11,8 @@ from ._version import __version__, __version_info__  # noqa
 # Version of the SAML standard supported.
 from .schema import VERSION as SAML_VERSION
 
-from .signature import sign, verify
+from .signature import sign, verify, verify_element
+from .batch import sign_many, verify_many
 from . import client
 
 VERSION = __version__
@@ -21,5 +22,8 @@ __all__ = [
     'SAML_VERSION',
     'sign',
     'verify',
+    'verify_element',
+    'sign_many',
+    'verify_many',
     'client'
 ]
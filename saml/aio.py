@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sign and verify signatures from `asyncio` without blocking the event loop.
+
+The signature operations run on a bounded pool of threads; this module
+requires Python 3.7+.
+
+.. autofunction:: async_sign
+.. autofunction:: async_verify
+
+.. autoclass:: Executor
+    :members:
+"""
+import asyncio
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from saml import signature
+
+
+class Executor(object):
+    """
+    A bounded pool of threads to run signature operations on.
+
+    At most `workers` operations run at once and at most `queue_size`
+    more wait for a thread; further callers wait for room in the queue
+    (or fail with `asyncio.QueueFull` when they ask not to wait). The
+    executor may be shared by several event loops; callers wait for room
+    in the queue of their own loop.
+
+    The time operations spent waiting for a thread and the time they
+    spent running are accumulated separately in `queued_time` and
+    `run_time`.
+
+    :param int workers: The number of threads
+    :param int queue_size: The number of operations that may wait for
+        a thread
+    """
+
+    def __init__(self, workers=4, queue_size=64):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(workers)
+
+        # The semaphores limiting the operations of each event loop.
+        self._slots = weakref.WeakKeyDictionary()
+
+        # The number of operations submitted and not yet completed.
+        self.pending = 0
+
+        # Counters of completed operations.
+        self.completed = 0
+        self.queued_time = 0.0
+        self.run_time = 0.0
+
+    async def run(self, fn, *args, wait=True):
+        """
+        Run `fn(*args)` on a thread of the pool and return its result.
+
+        :param bool wait: Whether to wait for room in the queue when it is
+            full instead of raising `asyncio.QueueFull`
+        """
+        # Semaphores belong to a loop; create one for each loop lazily.
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            self._slots[loop] = slots = asyncio.Semaphore(
+                self.workers + self.queue_size)
+
+        if not wait and self.pending >= self.workers + self.queue_size:
+            raise asyncio.QueueFull()
+
+        def call():
+            started = time.monotonic()
+            result = fn(*args)
+            return result, started, time.monotonic()
+
+        self.pending += 1
+        try:
+            async with slots:
+                submitted = time.monotonic()
+                result, started, finished = await loop.run_in_executor(
+                    self._executor, call)
+
+        finally:
+            self.pending -= 1
+
+        self.completed += 1
+        self.queued_time += started - submitted
+        self.run_time += finished - started
+
+        return result
+
+    def shutdown(self, wait=True):
+        """Stop the threads of the pool."""
+        self._executor.shutdown(wait)
+
+
+# The executor used when none is given.
+_executor = None
+
+
+def _default_executor():
+    global _executor
+    if _executor is None:
+        _executor = Executor()
+
+    return _executor
+
+
+async def async_sign(xml, stream, password=None, executor=None, wait=True):
+    """
+    Sign an XML document on a thread of the executor; see
+    :func:`saml.signature.sign`.
+
+    :param lxml.etree._Element xml: The document to sign
+    :param file stream: The private key to sign the document with, or a
+        :class:`saml.signature.Signer`
+    :param str password: The password used to access the private key
+    :param Executor executor: The executor to run on
+    :param bool wait: Whether to wait for room in the executor's queue
+
+    :rtype: None
+    """
+    executor = executor or _default_executor()
+    if isinstance(stream, signature.Signer):
+        return await executor.run(stream.sign, xml, wait=wait)
+
+    return await executor.run(
+        signature.sign, xml, stream, password, wait=wait)
+
+
+async def async_verify(xml, stream, executor=None, wait=True):
+    """
+    Verify the signature of an XML document on a thread of the executor;
+    see :func:`saml.signature.verify`.
+
+    :param lxml.etree._Element xml: The document to verify
+    :param file stream: The public key or certificate to verify with, or a
+        :class:`saml.signature.Verifier` or
+        :class:`saml.signature.TrustStore`
+    :param Executor executor: The executor to run on
+    :param bool wait: Whether to wait for room in the executor's queue
+
+    :rtype: Boolean
+    """
+    executor = executor or _default_executor()
+    if isinstance(stream, (signature.Verifier, signature.TrustStore)):
+        return await executor.run(stream.verify, xml, wait=wait)
+
+    return await executor.run(signature.verify, xml, stream, wait=wait)
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+"""
+Issue and resolve artifacts (the HTTP-Artifact binding).
+
+The identity provider keeps the messages it sends in a :class:`Store`
+and sends an artifact referencing them through the browser instead; the
+service provider then resolves the artifact with a :class:`Resolver`,
+which fetches the message back-channel (through the SOAP binding) from
+the :meth:`Store.respond` endpoint of the identity provider.
+
+.. autofunction:: create
+.. autofunction:: parse
+
+.. autoclass:: Store
+    :members:
+
+.. autoclass:: MemoryBackend
+    :members:
+
+.. autoclass:: Resolver
+    :members:
+"""
+import base64
+import binascii
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import six
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit
+from lxml import etree
+from saml import schema
+from saml.schema.utils import fromstring
+
+# The type code of the artifacts issued (the only one defined by
+# SAML/2.0).
+TYPE_CODE = 0x0004
+
+# The namespace of SOAP/1.1 envelopes.
+_SOAP_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+# The value of the SOAPAction header of SAML/2.0 SOAP requests.
+_SOAP_ACTION = 'http://www.oasis-open.org/committees/security'
+
+# The monotonic clock used to expire stored messages.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def _identifier():
+    """Generate a random identifier for a message."""
+    return '_%s' % binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+def create(entity_id, index=0, handle=None):
+    """
+    Create an artifact (of type `0x0004`) referencing a message sent by the
+    given entity.
+
+    :param str entity_id: The entity ID of the issuer of the artifact
+    :param int index: The index of the artifact resolution endpoint of the
+        issuer to resolve the artifact at
+    :param bytes handle: The (20 bytes) message handle; a random one is
+        generated when none is given
+
+    :rtype: str
+    """
+    if handle is None:
+        handle = os.urandom(20)
+
+    if len(handle) != 20:
+        raise ValueError('message handle must be 20 bytes', handle)
+
+    # The type code and endpoint index are big-endian 2-byte integers.
+    data = bytearray((TYPE_CODE >> 8, TYPE_CODE & 0xff, index >> 8,
+                      index & 0xff))
+    data += hashlib.sha1(entity_id.encode('utf-8')).digest()
+    data += handle
+    return base64.b64encode(bytes(data)).decode('ascii')
+
+
+def parse(artifact):
+    """
+    Parse an artifact (of type `0x0004`) into its endpoint index, source ID
+    (the SHA-1 digest of the issuer's entity ID) and message handle.
+
+    :param str artifact: The artifact
+
+    :rtype: tuple
+    """
+    try:
+        data = bytearray(base64.b64decode(artifact))
+
+    except (TypeError, ValueError):
+        raise ValueError('malformed artifact', artifact)
+
+    if len(data) != 44 or (data[0] << 8 | data[1]) != TYPE_CODE:
+        raise ValueError('malformed artifact', artifact)
+
+    return data[2] << 8 | data[3], bytes(data[4:24]), bytes(data[24:])
+
+
+class MemoryBackend(object):
+    """
+    Keep stored messages in memory, in this process.
+
+    At most `maxsize` messages are kept; the oldest are dropped first.
+
+    A backend is any object with the `add` and `pop` methods of this one;
+    others (e.g. keeping messages in a shared cache) may be given to
+    :class:`Store`.
+
+    :param int maxsize: The maximum number of messages to keep
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, value, expires):
+        """
+        Keep a value until the given time (of the store's clock).
+
+        :param bytes key: The key (message handle) of the value
+        :param bytes value: The value
+        :param float expires: When the value expires
+        """
+        with self._lock:
+            # Drop expired entries first, then the oldest ones.
+            now = _clock()
+            while self._entries:
+                _, (_, oldest) = next(iter(self._entries.items()))
+                if oldest > now and len(self._entries) < self.maxsize:
+                    break
+
+                self._entries.popitem(last=False)
+
+            self._entries[key] = value, expires
+
+    def pop(self, key):
+        """
+        Remove and return a value along with its expiry time, or `None` if
+        there is no such value.
+
+        :param bytes key: The key (message handle) of the value
+
+        :rtype: tuple
+        """
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Store(object):
+    """
+    Keep the messages an entity sends through the HTTP-Artifact binding
+    until they're resolved, for at most `ttl` seconds.
+
+    Each message can only be resolved once.
+
+    :param str entity_id: The entity ID of the issuer of the artifacts
+    :param int index: The index of the artifact resolution endpoint
+    :param int ttl: The number of seconds messages are kept
+    :param backend: Where messages are kept; a :class:`MemoryBackend` by
+        default
+    """
+
+    def __init__(self, entity_id, index=0, ttl=60, backend=None):
+        self.entity_id = entity_id
+        self.index = index
+        self.ttl = ttl
+        self.backend = MemoryBackend() if backend is None else backend
+        self.source_id = hashlib.sha1(entity_id.encode('utf-8')).digest()
+
+    def issue(self, message):
+        """
+        Store a message and return an artifact referencing it.
+
+        :param lxml.etree._Element message: The message
+
+        :rtype: str
+        """
+        handle = os.urandom(20)
+        self.backend.add(
+            handle, etree.tostring(message), _clock() + self.ttl)
+
+        return create(self.entity_id, self.index, handle)
+
+    def take(self, artifact):
+        """
+        Remove and return the message referenced by an artifact, or `None`
+        if it isn't stored (anymore).
+
+        :param str artifact: The artifact
+
+        :rtype: lxml.etree._Element
+        """
+        try:
+            _, source_id, handle = parse(artifact)
+
+        except ValueError:
+            return None
+
+        if source_id != self.source_id:
+            # Not one of ours.
+            return None
+
+        entry = self.backend.pop(handle)
+        if entry is None:
+            return None
+
+        text, expires = entry
+        if expires <= _clock():
+            # The message expired.
+            return None
+
+        return fromstring(text)
+
+    def respond(self, body, signer=None, trust=None):
+        """
+        Respond to an <ArtifactResolve> request sent through the SOAP
+        binding with the referenced message.
+
+        :param bytes body: The SOAP request
+        :param saml.signature.Signer signer: Signs the <ArtifactResponse>
+        :param trust: A :class:`saml.signature.Verifier` (or
+            :class:`saml.signature.TrustStore`) the request must be signed
+            by, if any
+
+        :rtype: bytes
+        """
+        # Find the request in the envelope.
+        request = fromstring(body).find(
+            '{%s}Body/%s' % (_SOAP_NS, schema.ArtifactResolve.name))
+        if request is None:
+            raise ValueError('not an artifact resolution request', body)
+
+        # Build the response.
+        response = schema.ArtifactResponse()
+        response.id = _identifier()
+        response.in_response_to = request.get('ID')
+        response.issue_instant = datetime.utcnow()
+        response.issuer = self.entity_id
+
+        message = None
+        if trust is not None and trust.verify_element(request) is None:
+            response.status.code.value = schema.StatusCode.REQUESTER
+
+        else:
+            response.status.code.value = schema.StatusCode.SUCCESS
+            artifact = request.find(schema.Artifact.name)
+            if artifact is not None and artifact.text:
+                message = self.take(artifact.text.strip())
+
+        # Embed the message after the status; an empty response is sent
+        # when the artifact isn't known.
+        xml = response.serialize()
+        if message is not None:
+            xml.append(message)
+
+        if signer is not None:
+            signer.sign(xml, reference=True)
+
+        return _envelope(xml)
+
+
+def _envelope(xml):
+    """Wrap an element in a SOAP envelope."""
+    envelope = etree.Element('{%s}Envelope' % _SOAP_NS, nsmap={
+        'soap': _SOAP_NS})
+    etree.SubElement(envelope, '{%s}Body' % _SOAP_NS).append(xml)
+    return etree.tostring(envelope, xml_declaration=True, encoding='utf-8')
+
+
+class _Pool(object):
+    """Idle keep-alive connections, by host."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """
+        Take an idle connection to a host, or open a new one; the second
+        item tells whether the connection was reused.
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+
+        if scheme == 'https':
+            return http_client.HTTPSConnection(
+                netloc, timeout=self.timeout), False
+
+        return http_client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def put(self, scheme, netloc, connection):
+        """Keep a connection for reuse, unless enough are kept already."""
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class Resolver(object):
+    """
+    Resolve artifacts through the SOAP binding, reusing (keep-alive)
+    connections to the artifact resolution endpoints.
+
+    :param dict endpoints: The URI of the artifact resolution endpoint of
+        each identity provider (by entity ID); a list of URIs (by endpoint
+        index) may be given for an identity provider with several
+    :param str issuer: The entity ID of the requester
+    :param saml.signature.Signer signer: Signs the <ArtifactResolve>
+        requests, if given
+    :param trust: A :class:`saml.signature.Verifier` (or
+        :class:`saml.signature.TrustStore`) the <ArtifactResponse> must be
+        signed by, if any
+    :param int pool_size: The number of idle connections kept per host
+    :param float timeout: The timeout of requests, in seconds
+    """
+
+    def __init__(self, endpoints, issuer=None, signer=None, trust=None,
+                 pool_size=4, timeout=10):
+        self.issuer = issuer
+        self.signer = signer
+        self.trust = trust
+        self._pool = _Pool(pool_size, timeout)
+
+        # Index the endpoints by the source ID of the identity providers.
+        self._endpoints = {}
+        for entity_id, uris in endpoints.items():
+            if isinstance(uris, six.string_types):
+                uris = [uris]
+
+            source_id = hashlib.sha1(entity_id.encode('utf-8')).digest()
+            self._endpoints[source_id] = list(uris)
+
+    def resolve(self, artifact):
+        """
+        Resolve an artifact into the message it references; returns `None`
+        if it couldn't be resolved.
+
+        :param str artifact: The artifact
+
+        :rtype: lxml.etree._Element
+        """
+        try:
+            index, source_id, _ = parse(artifact)
+
+        except ValueError:
+            return None
+
+        uris = self._endpoints.get(source_id)
+        if not uris:
+            # Unknown identity provider.
+            return None
+
+        if index >= len(uris):
+            # Unknown endpoint.
+            return None
+
+        uri = uris[index]
+
+        # Build the request.
+        request = schema.ArtifactResolve()
+        request.id = _identifier()
+        request.issue_instant = datetime.utcnow()
+        request.destination = uri
+        if self.issuer:
+            request.issuer = self.issuer
+
+        request.artifact = artifact
+        xml = request.serialize()
+        if self.signer is not None:
+            self.signer.sign(xml, reference=True)
+
+        status, body = self._post(uri, _envelope(xml))
+        if status != 200:
+            return None
+
+        # Find the response in the envelope.
+        response = fromstring(body).find(
+            '{%s}Body/%s' % (_SOAP_NS, schema.ArtifactResponse.name))
+        if response is None:
+            return None
+
+        if response.get('InResponseTo') != request.id:
+            return None
+
+        code = response.find('%s/%s' % (
+            schema.Status.name, schema.StatusCode.name))
+        if code is None or code.get('Value') != schema.StatusCode.SUCCESS:
+            return None
+
+        if self.trust is not None:
+            if self.trust.verify_element(response) != response.get('ID'):
+                return None
+
+        # The message follows the status.
+        message = code.getparent().getnext()
+        if message is None or not isinstance(message.tag, six.string_types):
+            return None
+
+        # Detach a copy of the message from the envelope.
+        return copy.deepcopy(message)
+
+    def _post(self, uri, body):
+        """
+        Post a SOAP request, on an idle connection to the host if there is
+        one; returns the status and body of the response.
+        """
+        parts = urlsplit(uri)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        headers = {
+            'Content-Type': 'text/xml; charset=utf-8',
+            'SOAPAction': _SOAP_ACTION,
+        }
+
+        while True:
+            connection, reused = self._pool.get(parts.scheme, parts.netloc)
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+
+            except (http_client.HTTPException, IOError):
+                connection.close()
+                if reused:
+                    # The connection was closed while idle; try again on
+                    # another one.
+                    continue
+
+                raise
+
+            if response.will_close:
+                connection.close()
+
+            else:
+                self._pool.put(parts.scheme, parts.netloc, connection)
+
+            return response.status, data
+
+    def close(self):
+        """Close the idle connections."""
+        self._pool.close()
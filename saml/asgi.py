@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Serve the SAML endpoints of an entity from an ASGI application; see
+:mod:`saml.wsgi`.
+
+Request bodies are read incrementally, up to a maximum size, and the
+messages are decoded, parsed, verified and handled on the threads of a
+:class:`saml.aio.Executor` so the event loop is never blocked. This
+module requires Python 3.7+.
+
+.. autoclass:: Middleware
+    :members:
+"""
+from saml import client
+from saml.aio import _default_executor
+from saml.wsgi import _Endpoints, _response
+
+
+class Middleware(_Endpoints):
+    """
+    ASGI middleware serving the SAML endpoints of an entity; takes the
+    parameters of :class:`saml.wsgi.Middleware`.
+
+    The handler is called with the ASGI connection scope instead of the
+    WSGI environment, on a thread of the executor.
+
+    :param saml.aio.Executor executor: The executor messages are processed
+        on; a shared one by default
+    """
+
+    def __init__(self, app, handler, executor=None, **kwargs):
+        super(Middleware, self).__init__(app, handler, **kwargs)
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        endpoint = None
+        if scope['type'] == 'http':
+            endpoint = self.route(scope['path'])
+
+        if endpoint is None:
+            # Not one of ours.
+            return await self.app(scope, receive, send)
+
+        method = scope['method']
+        if endpoint == 'metadata':
+            if method not in ('GET', 'HEAD'):
+                response = _response('405 Method Not Allowed')
+
+            else:
+                response = self.serve_metadata()
+
+            return await _send(send, *response)
+
+        body = b''
+        if method == 'POST':
+            try:
+                body = await self._read(scope, receive)
+
+            except client.MessageTooLarge:
+                return await _send(send, *_response('413 Payload Too Large'))
+
+            if body is None:
+                # The client disconnected.
+                return
+
+        # Receive and handle the message on a thread.
+        executor = self.executor or _default_executor()
+        response = await executor.run(
+            self.process, endpoint, method, scope.get('query_string', b''),
+            body, scope)
+
+        await _send(send, *response)
+
+    async def _read(self, scope, receive):
+        """
+        Read the body of a request, giving up as soon as it exceeds the
+        maximum size; returns `None` if the client disconnected.
+        """
+        # Refuse bodies announced as too large without reading them.
+        for name, value in scope.get('headers', ()):
+            if name == b'content-length':
+                if value.isdigit() and int(value) > self.max_body_size:
+                    raise client.MessageTooLarge(
+                        'request body too large', int(value))
+
+        body = bytearray()
+        while True:
+            event = await receive()
+            if event['type'] == 'http.disconnect':
+                return None
+
+            body += event.get('body', b'')
+            if len(body) > self.max_body_size:
+                raise client.MessageTooLarge(
+                    'request body too large', len(body))
+
+            if not event.get('more_body', False):
+                return body
+
+
+async def _send(send, status, headers, body):
+    """Send a response built by the handler."""
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split(None, 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
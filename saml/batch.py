@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sign and verify many documents at once across a pool of worker processes.
+
+.. autofunction:: sign_many
+.. autofunction:: verify_many
+"""
+import functools
+import time
+from six.moves import queue
+from lxml import etree
+from saml.schema.utils import fromstring
+from saml.signature import Signer, _read
+
+
+class Batch(list):
+    """
+    The results of a batch operation, in the order of its input, along
+    with how long the operation took.
+    """
+
+    def __init__(self, results, elapsed):
+        super(Batch, self).__init__(results)
+
+        # The number of seconds the batch took.
+        self.elapsed = elapsed
+
+    @property
+    def rate(self):
+        """The number of documents processed per second."""
+        if not self.elapsed:
+            return float(len(self))
+
+        return len(self) / self.elapsed
+
+
+# The signer of the current worker process.
+_signer = None
+
+
+def _initialize_signer(data, password, algorithm, digest):
+    # Load the key once for the lifetime of the worker.
+    global _signer
+    _signer = Signer(data, password, algorithm=algorithm, digest=digest)
+
+
+def _sign(document, signer=None):
+    # Serialize the document; serialized elements are sent as bytes as
+    # they cannot be sent to another process.
+    if isinstance(document, bytes):
+        xml = fromstring(document)
+
+    else:
+        xml = document.serialize()
+
+    # Sign the document and send it back serialized.
+    (signer or _signer).sign(xml)
+    return etree.tostring(xml)
+
+
+def sign_many(documents, key, password=None, workers=None, parse=False,
+              chunksize=None, algorithm='rsa-sha1', digest=None):
+    """
+    Serialize and sign many documents across a pool of worker processes.
+    Each worker loads the private key once.
+
+    :param list documents: The documents (`saml.schema` objects or
+        serialized XML) to sign
+    :param file key: The private key to sign the documents with
+    :param str password: The password used to access the private key
+    :param int workers: The number of worker processes; defaults to the
+        number of CPUs. With one worker the documents are signed in the
+        calling process.
+    :param bool parse: Whether to return the signed documents as
+        elements instead of bytes
+    :param int chunksize: The number of documents sent to a worker at once
+    :param str algorithm: The signature algorithm
+    :param str digest: The digest algorithm
+
+    :rtype: Batch
+
+    Example usage:
+    ::
+        with open('my_key_file.pem', 'rb') as stream:
+            batch = sign_many(responses, stream, workers=4)
+
+        print('signed %d documents/s' % batch.rate)
+    """
+    import multiprocessing
+
+    # Read the key once and send its encoded form to the workers.
+    data = _read(key)
+
+    # Serialized elements are sent across as bytes.
+    documents = [etree.tostring(document)
+                 if isinstance(document, etree._Element) else document
+                 for document in documents]
+
+    start = time.time()
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1:
+        # Sign in the calling process.
+        signer = Signer(data, password, algorithm=algorithm, digest=digest)
+        results = [_sign(document, signer) for document in documents]
+
+    else:
+        pool = multiprocessing.Pool(
+            workers, _initialize_signer, (data, password, algorithm, digest))
+        try:
+            results = pool.map(_sign, documents, chunksize)
+
+        finally:
+            pool.close()
+            pool.join()
+
+    if parse:
+        results = [fromstring(result) for result in results]
+
+    return Batch(results, time.time() - start)
+
+
+# The trusted keys of the current worker process.
+_trust = None
+
+
+def _initialize_trust(trust):
+    # The keys were loaded once when the trust was received.
+    global _trust
+    _trust = trust
+
+
+def _verify(item, trust=None):
+    index, message = item
+    if isinstance(message, bytes):
+        message = fromstring(message)
+
+    return index, (trust or _trust).verify(message)
+
+
+def _caught(verify, item):
+    # Send errors back as results; pools only report errors to a callback
+    # of their own from Python 3.2.
+    try:
+        return verify(item)
+
+    except Exception as error:
+        return error
+
+
+def _result(result):
+    # Raise the errors of the workers in the calling process.
+    if isinstance(result, BaseException):
+        raise result
+
+    return result
+
+
+def verify_many(messages, trust, workers=None, threads=False, window=None):
+    """
+    Verify many messages across a pool of worker processes (or threads),
+    yielding `(index, ok)` as each verification completes. Each worker
+    loads the trusted keys once.
+
+    At most `window` messages are in flight at once; another is consumed
+    from the iterable as each completes, so the workers stay busy and
+    memory stays flat for arbitrarily large batches.
+
+    :param iterable messages: The messages (elements or serialized XML)
+        to verify
+    :param trust: The keys to verify with; a
+        :class:`saml.signature.Verifier` or
+        :class:`saml.signature.TrustStore`
+    :param int workers: The number of workers; defaults to the number of
+        CPUs. With one worker the messages are verified in the calling
+        process.
+    :param bool threads: Whether to use a pool of threads instead of
+        processes
+    :param int window: The number of messages in flight at once
+
+    :rtype: iterator of (int, bool)
+
+    Example usage:
+    ::
+        trust = TrustStore([certificate])
+        for index, ok in verify_many(queue, trust, workers=4):
+            if not ok:
+                print('message %d is not valid' % index)
+    """
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    messages = enumerate(messages)
+    if workers <= 1:
+        # Verify in the calling process.
+        for item in messages:
+            yield _verify(item, trust)
+
+        return
+
+    if threads:
+        # Threads share the trust (and its loaded keys) directly.
+        pool = ThreadPool(workers)
+        verify = functools.partial(_verify, trust=trust)
+
+    else:
+        pool = multiprocessing.Pool(workers, _initialize_trust, (trust,))
+        verify = _verify
+
+    # Results (or errors) are queued by the pool as they complete.
+    window = window or workers * 16
+    done = queue.Queue()
+    pending = 0
+    try:
+        for index, message in messages:
+            if not threads and isinstance(message, etree._Element):
+                # Serialized elements are sent across as bytes.
+                message = etree.tostring(message)
+
+            pool.apply_async(_caught, (verify, (index, message)),
+                             callback=done.put)
+            pending += 1
+
+            # Yield what has completed meanwhile; keep at most `window`
+            # messages in flight by waiting for one to complete before
+            # consuming another.
+            while pending and (pending >= window or not done.empty()):
+                yield _result(done.get())
+                pending -= 1
+
+        while pending:
+            yield _result(done.get())
+            pending -= 1
+
+    finally:
+        pool.close()
+        pool.join()
@@ -1,40 +1,166 @@
 # -*- coding: utf-8 -*-
 import base64
+import binascii
+import copy
+import re
+import time
 import zlib
+from collections import OrderedDict, namedtuple
 import six
-from six.moves.urllib.parse import urlencode, parse_qs, unquote_plus
+from six.moves.urllib.parse import urlencode, unquote_to_bytes
 from lxml import etree
 from saml import schema
 from saml.schema.base import _element_registry
+from saml.schema.utils import fromstring, pull_parser
 
 
-def send(uri, message, relay_state=None, protocol='redirect'):
+# The clock used to time the stages of receiving messages.
+_timer = getattr(time, 'perf_counter', time.time)
+
+# The default maximum size of an encoded message (as received).
+MAX_ENCODED_SIZE = 1024 * 1024
+
+# The default maximum size of a decoded (and inflated) message.
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+
+
+class MessageTooLarge(ValueError):
+    """
+    Raised when a received message exceeds the maximum encoded or decoded
+    size.
+    """
+
+
+# The page sent for the HTTP-POST binding; it submits itself when loaded
+# (or when the button is pressed, without scripts).
+_FORM = (
+    b'<!DOCTYPE html>\n'
+    b'<html><head><meta charset="utf-8"></head>'
+    b'<body onload="document.forms[0].submit()">'
+    b'<form method="post" action="%s">'
+    b'<input type="hidden" name="%s" value="%s"/>'
+    b'%s'
+    b'<noscript><input type="submit" value="Continue"/></noscript>'
+    b'</form></body></html>\n')
+
+_RELAY_STATE = b'<input type="hidden" name="RelayState" value="%s"/>'
+
+
+def _escape(text):
+    """Escape text for use in a (double-quoted) HTML attribute."""
+    text = _bytes(text)
+    if b'&' in text:
+        text = text.replace(b'&', b'&amp;')
+
+    return text.replace(b'"', b'&quot;').replace(b'<', b'&lt;').replace(
+        b'>', b'&gt;')
+
+
+def _form(uri, name, encoded, relay_state):
+    """
+    Render the auto-submitting form of the HTTP-POST binding; the encoded
+    message (base64) is inserted as it is.
+    """
+    fields = b''
+    if relay_state:
+        fields = _RELAY_STATE % _escape(relay_state)
+
+    return _FORM % (_escape(uri), name.encode('ascii'), encoded, fields)
+
+
+def send(uri, message, relay_state=None, protocol='redirect', signer=None,
+         binary=False):
+    """
+    Prepare a message to be sent with the given protocol.
+
+    Messages sent through the HTTP-POST binding (`post`) are returned as
+    the second item in an HTML page with a form that submits itself to the
+    URI when loaded; as `bytes` (UTF-8), ready to be written to the
+    response, if `binary` is set. When a :class:`saml.signature.Signer` is
+    given, the message is signed (enveloped) first; the given element is
+    left as it is.
+
+    When a :class:`saml.signature.Signer` is given, messages sent through
+    the HTTP-Redirect binding carry a detached signature of the query
+    string (the `SigAlg` and `Signature` parameters) instead of an
+    enveloped XML signature.
+
+    Messages sent through the HTTP-POST-SimpleSign binding (`simplesign`)
+    are signed the same way over the values of the form fields, which
+    are returned (in order) as the second item.
+    """
 
     # Determine the name of parameter.
     element = _element_registry.get(message.tag)
     if not element:
         raise ValueError('unknown element', message)
 
+    # The message is encoded (depending on what it is) as SAMLRequest
+    # or SAMLResponse.
+    name = 'SAMLRequest'
+    if issubclass(element, schema.StatusResponse):
+        name = 'SAMLResponse'
+
     if protocol == 'redirect':
         # For sending a message through redirection; we need
-        # to encode the message (depending on what it is) in the URI
-        # as SAMLRequest or SAMLResponse.
-        name = 'SAMLRequest'
-        if isinstance(element, schema.StatusResponse):
-            name = 'SAMLResponse'
+        # to encode the message in the URI.
 
         # Serialize and encode the message.
         text = base64.b64encode(zlib.compress(etree.tostring(message))[2:-4])
 
         # Build the parameters.
-        parameters = {name: text}
+        parameters = [(name, text)]
         if relay_state:
-            parameters['RelayState'] = relay_state
+            parameters.append(('RelayState', relay_state))
+
+        query = urlencode(parameters)
+        if signer is not None:
+            # Sign the encoded parameters, in order, along with the
+            # signature algorithm.
+            query += '&' + urlencode([('SigAlg', signer.algorithm.href)])
+            signature = base64.b64encode(signer.sign_binary(
+                query.encode('ascii')))
+            query += '&' + urlencode([('Signature', signature)])
 
         # Append the parameters on the uri and return.
-        uri = '%s?%s' % (uri, urlencode(parameters))
+        uri = '%s?%s' % (uri, query)
         return uri, None
 
+    if protocol == 'simplesign':
+        if signer is None:
+            raise ValueError('signer is required', protocol)
+
+        # Serialize and encode the message.
+        text = _text(base64.b64encode(etree.tostring(message)))
+
+        # Build the form fields.
+        fields = [(name, text)]
+        if relay_state:
+            fields.append(('RelayState', relay_state))
+
+        fields.append(('SigAlg', signer.algorithm.href))
+
+        # Sign the values of the fields, in order.
+        signature = signer.sign_binary(_simple_sign_octets(fields))
+        fields.append(('Signature', _text(base64.b64encode(signature))))
+        return uri, fields
+
+    if protocol == 'post':
+        if signer is not None:
+            # Sign a copy of the message; the signature is enveloped.
+            message = copy.deepcopy(message)
+            signer.sign(message)
+
+        # Serialize and encode the message in one go.
+        text = base64.b64encode(etree.tostring(message))
+
+        # Render the form.
+        form = _form(uri, name, text, relay_state)
+        if not binary:
+            form = form.decode('utf-8')
+
+        return uri, form
+
     raise ValueError('unknown protocol', protocol)
 
 
@@ -45,40 +171,543 @@ def _text(str_or_bytes):
     return str_or_bytes.decode()
 
 
-def receive(method, query_string, body):
-    # Determine the protocol used and pare the appropriate data.
+def _bytes(data):
+    """Return text as bytes; bytes-like objects are used as they are."""
+    if isinstance(data, six.text_type):
+        return data.encode('utf-8')
+
+    return data
+
+
+# The parameters of the SAML bindings, as they appear in an URL encoded
+# query string or form.
+_parameter = re.compile(
+    b'(?:^|&)(SAMLRequest|SAMLResponse|RelayState|SAMLArtifact|SigAlg|'
+    b'Signature)=([^&]*)')
+
+# Characters that need decoding in an URL encoded value.
+_escaped = re.compile(b'[%+]')
+
+
+def _parameters(data):
+    """
+    Find the parameters of the SAML bindings in an URL encoded query string
+    or form in one pass, ignoring any others.
+
+    The values are returned as they were encoded; slices of the buffer
+    when it is a `memoryview` (first one wins).
+    """
+    parameters = {}
+    for match in _parameter.finditer(data):
+        name = match.group(1).decode('ascii')
+        if name not in parameters:
+            parameters[name] = data[match.start(2):match.end(2)]
+
+    return parameters
+
+
+def _unquote(value):
+    """Decode an URL encoded value into bytes."""
+    if _escaped.search(value) is None:
+        # Nothing to decode.
+        return value
+
+    return unquote_to_bytes(bytes(value).replace(b'+', b' '))
+
+
+def _simple_sign_octets(fields):
+    """
+    Build the octets signed by the HTTP-POST-SimpleSign binding from the
+    (decoded) values of the form fields.
+    """
+    fields = dict(fields)
+    return b'&'.join(
+        name.encode('ascii') + b'=' + _bytes(fields[name])
+        for name in ('SAMLRequest', 'SAMLResponse', 'RelayState', 'SigAlg')
+        if name in fields)
+
+
+def _verify_form(parameters, trust):
+    """
+    Verify the signature of a form received through the
+    HTTP-POST-SimpleSign binding.
+    """
+    fields = dict((name, _unquote(value))
+                  for name, value in parameters.items())
+    try:
+        signature = binascii.a2b_base64(fields['Signature'])
+
+    except (TypeError, ValueError):
+        return False
+
+    octets = _simple_sign_octets(fields)
+    algorithm = bytes(fields['SigAlg']).decode('utf-8')
+    return trust.verify_binary(octets, algorithm, signature)
+
+
+def _decode(encoded, inflate, max_encoded_size, max_size):
+    """
+    Decode (and inflate) an encoded message, giving up as soon as it
+    exceeds the maximum sizes.
+    """
+    if len(encoded) > max_encoded_size:
+        raise MessageTooLarge('encoded message too large', len(encoded))
+
+    # Base64 decoding only shrinks the message.
+    text = binascii.a2b_base64(_unquote(encoded))
+    if inflate:
+        # Inflate no more than one byte past the maximum size.
+        decompressor = zlib.decompressobj(-15)
+        text = decompressor.decompress(text, max_size + 1)
+        if len(text) <= max_size and not decompressor.unconsumed_tail:
+            text += decompressor.flush()
+
+    if len(text) > max_size:
+        raise MessageTooLarge('message too large')
+
+    return text
+
+
+def _signed(node, trust):
+    """Whether an element is itself signed (by its own ID) by the keys."""
+    identifier = node.get('ID')
+    return identifier is not None and (
+        trust.verify_element(node) == identifier)
+
+
+def _trusted(message, trust, assertions=True):
+    """
+    Whether the message is signed or else (when `assertions` is set) each
+    of its assertions is; a valid signature anywhere else in the document
+    is not enough, as it could be wrapped around a forged message.
+    """
+    if _signed(message, trust):
+        return True
+
+    if not assertions:
+        return False
+
+    nodes = message.findall(schema.Assertion.name)
+    return bool(nodes) and all(_signed(node, trust) for node in nodes)
+
+
+def _verify_message(text, message, trust, memo=None, assertions=True):
+    """
+    Verify the enveloped signature of a message (or of its assertions; see
+    :func:`_trusted`), looking the result up by the message bytes in the
+    memo first.
+    """
+    if memo is not None:
+        result = memo.get(text, trust.fingerprint)
+        if result is not None:
+            return result
+
+    result = _trusted(message, trust, assertions)
+    if memo is not None:
+        memo.set(text, trust.fingerprint, result)
+
+    return result
+
+
+def _verify_query(parameters, trust):
+    """
+    Verify the detached signature of a query string received through the
+    HTTP-Redirect binding.
+    """
+    if 'Signature' not in parameters or 'SigAlg' not in parameters:
+        # The message is not signed.
+        return False
+
+    # Rebuild the signed octets from the parameters as they were encoded.
+    octets = b'&'.join(
+        name.encode('ascii') + b'=' + parameters[name]
+        for name in ('SAMLRequest', 'SAMLResponse', 'RelayState', 'SigAlg')
+        if name in parameters)
+
+    try:
+        signature = binascii.a2b_base64(_unquote(parameters['Signature']))
+
+    except (TypeError, ValueError):
+        return False
+
+    algorithm = bytes(_unquote(parameters['SigAlg'])).decode('utf-8')
+    return trust.verify_binary(bytes(octets), algorithm, signature)
+
+
+class _Timings(object):
+    """Record the time spent in each stage of receiving a message."""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = _timer()
+
+    def __call__(self, stage):
+        if self.timings is not None:
+            now = _timer()
+            self.timings[stage] = self.timings.get(stage, 0) + now - self.last
+            self.last = now
+
+
+def _status(message):
+    """Return the status code of a response, or `None` for requests."""
+    code = message.find('%s/%s' % (schema.Status.name, schema.StatusCode.name))
+    if code is None:
+        return None
+
+    return code.get('Value')
+
+
+def _binding(method, query_string, body):
+    """
+    Determine the binding a message was sent with and find the parameters
+    of the binding; the binding is `None` for unknown methods.
+    """
     method = method.upper()
     if method == 'GET':
-        data = parse_qs(_text(query_string))
+        data = _parameters(_bytes(query_string))
         binding = 'artifact' if 'SAMLArtifact' in data else 'redirect'
 
     elif method == 'POST':
-        data = parse_qs(_text(body))
+        data = _parameters(_bytes(body))
         binding = 'post'
+        if 'SigAlg' in data and 'Signature' in data:
+            binding = 'simplesign'
 
     else:
         # Unknown method used.
-        return None
+        return None, {}
 
-    if binding in ('redirect', 'post'):
+    return binding, data
+
+
+def _encoded(data, max_encoded_size=None):
+    """
+    Pull the encoded message out of the parameters of a binding, checking
+    its size before anything else.
+    """
+    encoded = data.get('SAMLResponse', data.get('SAMLRequest'))
+    if max_encoded_size is None:
+        max_encoded_size = MAX_ENCODED_SIZE
+
+    if encoded and len(encoded) > max_encoded_size:
+        raise MessageTooLarge('encoded message too large', len(encoded))
+
+    return encoded
+
+
+def _relay_state(data):
+    """Decode the relay state, if present; the same for every binding."""
+    relay_state = data.get('RelayState')
+    if relay_state:
+        # Decoded exactly once; it's returned as it was sent (and signed).
+        relay_state = bytes(_unquote(relay_state)).decode('utf-8')
+
+    return relay_state
+
+
+def _receive(method, query_string, body, trust=None, memo=None,
+             max_encoded_size=None, max_size=None, resolver=None,
+             timings=None, check_status=False):
+    """
+    Receive a message; see :func:`receive`.
+
+    Returns the message, the relay state, the binding and whether the
+    signature of the message was verified, or `None`. The time spent in
+    each stage is accumulated in `timings` (if given).
+
+    When `check_status` is set, responses that aren't successful are only
+    trusted when they are signed themselves; their assertions are not
+    looked at.
+    """
+    mark = _Timings(timings)
+
+    # Determine the protocol used and pare the appropriate data.
+    binding, data = _binding(method, query_string, body)
+    mark('binding')
+    if binding in ('redirect', 'post', 'simplesign'):
         # Pull the text out of the query.
-        encoded = data.get('SAMLResponse', data.get('SAMLRequest'))
+        encoded = _encoded(data, max_encoded_size)
         if not encoded:
             # No SAML message found.
             return None
 
+        if max_encoded_size is None:
+            max_encoded_size = MAX_ENCODED_SIZE
+
+        # Verify the detached signature of the query string or form.
+        verified = False
+        if binding == 'redirect' and trust is not None:
+            if not _verify_query(data, trust):
+                return None
+
+            verified = True
+            mark('verify')
+
+        if binding == 'simplesign' and trust is not None:
+            if not _verify_form(data, trust):
+                return None
+
+            verified = True
+            mark('verify')
+
         # Decode the text.
-        text = base64.b64decode(encoded[0])
-        if binding == "redirect":
-            text = zlib.decompress(text, -15)
+        text = _decode(
+            encoded, binding == 'redirect', max_encoded_size,
+            MAX_MESSAGE_SIZE if max_size is None else max_size)
+
+        mark('decode')
 
         # Parse the text into xml.
-        message = etree.XML(text)
+        message = fromstring(text)
+        mark('parse')
+
+        # Verify the enveloped signature of the message.
+        if binding == 'post' and trust is not None:
+            # Unsuccessful responses carry no assertions to verify; only
+            # the response itself is.
+            status = _status(message) if check_status else None
+            mark('status')
+            successful = status in (None, schema.StatusCode.SUCCESS)
+            if not _verify_message(text, message, trust, memo, successful):
+                return None
+
+            verified = True
+            mark('verify')
 
         # Get the relay state if present.
-        relay_state = data.get('RelayState')
-        if relay_state:
-            relay_state = unquote_plus(relay_state[0])
+        relay_state = _relay_state(data)
+
+        # Return the message and the relay state.
+        return message, relay_state, binding, verified
+
+    if binding == 'artifact' and resolver is not None:
+        # Resolve the artifact back-channel.
+        artifact = bytes(_unquote(data['SAMLArtifact'])).decode('ascii')
+        message = resolver.resolve(artifact)
+        mark('resolve')
+        if message is None:
+            return None
+
+        relay_state = _relay_state(data)
+        return message, relay_state, binding, resolver.trust is not None
+
+
+def receive(method, query_string, body, trust=None, memo=None,
+            max_encoded_size=None, max_size=None, resolver=None):
+    """
+    Receive a message sent with any of the supported protocols.
+
+    The query string and body may be given as text or as any bytes-like
+    object (`bytes`, `bytearray` or `memoryview`) as read by the server;
+    they are scanned for the parameters of the SAML bindings only and
+    decoded without going through text.
+
+    Returns the message and the relay state, or `None` if no message was
+    found.
 
+    When a :class:`saml.signature.Verifier` (or
+    :class:`saml.signature.TrustStore`) is given as `trust`, messages
+    received through the HTTP-Redirect binding must carry a valid
+    detached signature of the query string and messages posted with
+    `SigAlg` and `Signature` fields (the HTTP-POST-SimpleSign binding)
+    a valid signature of the form fields and messages received through
+    the HTTP-POST binding a valid enveloped signature; `None` is returned
+    for those that don't.
+
+    The results of verifying enveloped signatures are memoized in the
+    :class:`saml.signature.Memo` given as `memo`, if any.
+
+    Messages larger than `max_encoded_size` bytes as received or
+    `max_size` bytes once decoded (defaulting to :data:`MAX_ENCODED_SIZE`
+    and :data:`MAX_MESSAGE_SIZE`) raise :class:`MessageTooLarge`; nothing
+    larger is ever decoded or inflated.
+
+    Artifacts received through the HTTP-Artifact binding are resolved into
+    the messages they reference with the :class:`saml.artifact.Resolver`
+    given as `resolver`; `None` is returned for them when there is none.
+    """
+    received = _receive(
+        method, query_string, body, trust, memo, max_encoded_size, max_size,
+        resolver)
+
+    if received is not None:
         # Return the message and the relay state.
-        return message, relay_state
+        return received[:2]
+
+
+Received = namedtuple(
+    'Received', 'message relay_state binding verified timings')
+
+
+def receive_message(method, query_string, body, trust=None, memo=None,
+                    max_encoded_size=None, max_size=None, resolver=None):
+    """
+    Receive a message sent with any of the supported protocols and
+    deserialize it; see :func:`receive`.
+
+    The message is parsed once and each stage works on the same tree,
+    cheapest first: the size and binding are checked before the message
+    is decoded, and the status of responses received through the
+    HTTP-POST binding is checked before their signature is verified;
+    when `trust` is given, unsuccessful responses must be signed
+    themselves (signed assertions are not looked at) and are returned as
+    verified, so they can be told apart from messages that aren't
+    trusted.
+
+    Returns a :class:`Received` tuple of the message (as a schema object),
+    the relay state, the binding, whether the signature of the message was
+    verified and the time spent in each stage (in seconds, by stage), or
+    `None` if no message was found (or it wasn't trusted).
+
+    :rtype: Received
+    """
+    timings = OrderedDict()
+    received = _receive(
+        method, query_string, body, trust, memo, max_encoded_size, max_size,
+        resolver, timings, check_status=True)
+
+    if received is None:
+        return None
+
+    message, relay_state, binding, verified = received
+
+    # Deserialize the message.
+    started = _timer()
+    message = schema.deserialize(message)
+    timings['deserialize'] = _timer() - started
+
+    return Received(message, relay_state, binding, verified, timings)
+
+
+Peek = namedtuple(
+    'Peek', 'binding tag id issuer destination in_response_to relay_state')
+
+# The size of the chunks messages are decoded and parsed in when peeking.
+_PEEK_CHUNK_SIZE = 4096
+
+
+# Characters that are not part of base64 encoded text (and are ignored
+# when decoding it).
+_not_base64 = re.compile(b'[^A-Za-z0-9+/=]')
+
+
+def _decoded(encoded):
+    """Decode an (URL and base64) encoded message in chunks."""
+    rest = b''
+    start = 0
+    while start < len(encoded):
+        # Never split an escape sequence.
+        end = start + _PEEK_CHUNK_SIZE
+        if end < len(encoded):
+            percent = bytes(encoded[end - 2:end]).rfind(b'%')
+            if percent >= 0:
+                end -= 2 - percent
+
+        # Decode whole groups of 4 characters.
+        text = rest + _not_base64.sub(b'', bytes(_unquote(encoded[start:end])))
+        cut = len(text) - len(text) % 4
+        rest = text[cut:]
+        start = end
+        yield binascii.a2b_base64(text[:cut])
+
+    if rest:
+        yield binascii.a2b_base64(rest)
+
+
+def _chunks(encoded, inflate, max_size):
+    """
+    Decode (and inflate) an encoded message in chunks, giving up as soon
+    as it exceeds the maximum size.
+    """
+    decompressor = zlib.decompressobj(-15) if inflate else None
+    size = 0
+    for text in _decoded(encoded):
+        while text:
+            if decompressor is None:
+                chunk, text = text, b''
+
+            else:
+                # Inflate no more than a chunk at a time.
+                chunk = decompressor.decompress(text, _PEEK_CHUNK_SIZE)
+                text = decompressor.unconsumed_tail
+
+            size += len(chunk)
+            if size > max_size:
+                raise MessageTooLarge('message too large')
+
+            yield chunk
+
+    if decompressor is not None:
+        yield decompressor.flush()
+
+
+def _events(parser, chunks):
+    """
+    Feed chunks of a document to a pull parser, yielding its events as
+    they come; the parser is closed (and the last events yielded) once
+    the document is read whole.
+    """
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event in parser.read_events():
+            yield event
+
+    parser.close()
+    for event in parser.read_events():
+        yield event
+
+
+def peek(method, query_string, body, max_encoded_size=None, max_size=None):
+    """
+    Find out where a message comes from and what it is about without
+    parsing (nor verifying) it whole; e.g. to choose what to receive it
+    with.
+
+    The message is decoded and parsed incrementally and only until the
+    attributes of the root element and the first <Issuer> are read.
+
+    Returns a :class:`Peek` tuple of the binding, the (qualified) tag,
+    `ID`, issuer, `Destination` and `InResponseTo` of the message and the
+    relay state, or `None` if no message was found. Only the binding and
+    relay state are known for artifacts.
+
+    :rtype: Peek
+    """
+    binding, data = _binding(method, query_string, body)
+    if binding is None:
+        return None
+
+    if binding == 'artifact':
+        return Peek(binding, None, None, None, None, None, _relay_state(data))
+
+    encoded = _encoded(data, max_encoded_size)
+    if not encoded:
+        # No SAML message found.
+        return None
+
+    # Parse until the attributes of the root and the issuer are known.
+    root = issuer = None
+    chunks = _chunks(encoded, binding == 'redirect',
+                     MAX_MESSAGE_SIZE if max_size is None else max_size)
+    for event, element in _events(pull_parser(), chunks):
+        if root is None:
+            # The attributes of the root are known from its start.
+            root = element
+
+        elif element.getparent() is not root:
+            continue
+
+        elif element.tag != schema.Issuer.name:
+            # The issuer, if any, is the first child of the root.
+            break
+
+        elif event == 'end':
+            issuer = (element.text or '').strip()
+            break
+
+    if root is None:
+        return None
+
+    return Peek(binding, root.tag, root.get('ID'), issuer,
+                root.get('Destination'), root.get('InResponseTo'),
+                _relay_state(data))
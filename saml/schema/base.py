@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
+import copy
 from collections import OrderedDict
 from lxml import etree
 import six
-from .utils import pascalize, classproperty
+from .utils import pascalize, classproperty, fromstring
 
 
 class Options(object):
@@ -293,6 +294,9 @@ class Base(six.with_metaclass(Declarative)):
         # The signature function tuple.
         self._sign_args = None
 
+        # The signed, serialized form of this element.
+        self._signed = None
+
     @classproperty
     def name(cls):
         # Return the namespaced name of the element.
@@ -369,9 +373,35 @@ class Base(six.with_metaclass(Declarative)):
         XML representation.
         """
 
+        if self._signed is not None:
+            # Reuse the signed form verbatim.
+            return copy.deepcopy(self._signed)
+
         # Serialize the root and return the serialized element.
         return self._serialize_item(self)
 
+    def sign(self, signer):
+        """
+        Serializes and signs this element once, referencing it by its ID.
+
+        Later serializations (on its own or as part of other elements)
+        reuse the signed XML verbatim; changes to the instance state are
+        not serialized until the element is signed again.
+
+        :param saml.signature.Signer signer: The signer to sign with
+
+        :rtype: lxml.etree._Element
+        """
+
+        # Serialize and sign the element.
+        self._signed = None
+        xml = self.serialize()
+        signer.sign(xml, reference=True)
+
+        # Keep the signed form and return it.
+        self._signed = xml
+        return copy.deepcopy(xml)
+
     def tostring(self):
         return etree.tostring(self.serialize())
 
@@ -446,4 +476,4 @@ class Base(six.with_metaclass(Declarative)):
 
     @classmethod
     def fromstring(cls, text):
-        return cls.deserialize(etree.XML(text))
+        return cls.deserialize(fromstring(text))
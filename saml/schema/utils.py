@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import re
+import threading
+from lxml import etree
 
 
 def _upcase_first_letter(s):
@@ -22,3 +24,42 @@ class classproperty(object):
 
     def __get__(self, obj, cls):
         return self.getter(cls)
+
+
+# Parsers of the current thread; lxml parsers may not be shared between
+# threads.
+_local = threading.local()
+
+# The options of the hardened parsers.
+_hardened = dict(
+    resolve_entities=False,
+    no_network=True,
+    huge_tree=False,
+    remove_comments=True)
+
+
+def parser():
+    """Returns the hardened XML parser of the current thread.
+
+    The parser does not resolve entities, never accesses the network,
+    refuses very deep or large trees and drops comments. Blank text is
+    kept as it is covered by signatures.
+    """
+    instance = getattr(_local, 'parser', None)
+    if instance is None:
+        _local.parser = instance = etree.XMLParser(**_hardened)
+
+    return instance
+
+
+def pull_parser(events=('start', 'end')):
+    """Returns a new hardened parser that is fed incrementally; see
+    :func:`parser`.
+    """
+    return etree.XMLPullParser(events=events, **_hardened)
+
+
+def fromstring(text):
+    """Parses an XML document with the hardened parser of the thread.
+    """
+    return etree.fromstring(text, parser())
@@ -5,10 +5,832 @@ Sign and verify signatures using the `python-xmlsec` library.
 
 .. autofunction:: sign
 .. autofunction:: verify
+.. autofunction:: verify_element
+
+.. autoclass:: Signer
+    :members:
+
+.. autoclass:: Verifier
+    :members:
+
+.. autoclass:: TrustStore
+    :members:
+
+.. autoclass:: KeyCache
+    :members:
+
+.. autoclass:: Memo
+    :members:
 """
+import base64
+import copy
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+import six
+from lxml import etree
+
+
+# Namespace of the XML digital signature elements.
+_DSIG_NS = 'http://www.w3.org/2000/09/xmldsig#'
+
+# Supported signature algorithms.
+SIGNATURE_ALGORITHMS = (
+    'rsa-sha1',
+    'rsa-sha256',
+    'rsa-sha384',
+    'rsa-sha512',
+    'ecdsa-sha256',
+    'ecdsa-sha384',
+)
+
+# Supported digest algorithms.
+DIGEST_ALGORITHMS = (
+    'sha1',
+    'sha256',
+    'sha384',
+    'sha512',
+)
+
+
+# Digest algorithms by their URI, by `hashlib` name.
+_DIGESTS = {
+    'http://www.w3.org/2000/09/xmldsig#sha1': 'sha1',
+    'http://www.w3.org/2001/04/xmlenc#sha256': 'sha256',
+    'http://www.w3.org/2001/04/xmldsig-more#sha384': 'sha384',
+    'http://www.w3.org/2001/04/xmlenc#sha512': 'sha512',
+}
+
+# Transforms understood by the digest check.
+_ENVELOPED = 'http://www.w3.org/2000/09/xmldsig#enveloped-signature'
+_EXCL_C14N = 'http://www.w3.org/2001/10/xml-exc-c14n#'
+_C14N = 'http://www.w3.org/TR/2001/REC-xml-c14n-20010315'
+
+
+def _algorithm(uri):
+    """Resolve the URI of a signature algorithm into its `xmlsec.Transform`."""
+    for name in SIGNATURE_ALGORITHMS:
+        transform = _transform(name, SIGNATURE_ALGORITHMS)
+        if transform.href == uri:
+            return transform
+
+
+def _transform(name, names):
+    """Resolve the name of an algorithm into its `xmlsec.Transform`."""
+    import xmlsec
+
+    if name not in names:
+        raise ValueError('unknown algorithm', name)
+
+    return getattr(xmlsec.Transform, name.upper().replace('-', '_'))
+
+
+def _read(stream):
+    """Read the key material from a file-like object, text or bytes."""
+    data = stream
+    if hasattr(stream, 'read'):
+        # Read it whole, even when the stream was read before.
+        seekable = getattr(stream, 'seekable', None)
+        if hasattr(stream, 'seek') and (seekable is None or seekable()):
+            stream.seek(0)
+
+        data = stream.read()
+
+    if isinstance(data, six.text_type):
+        # Keys are PEM encoded; they're ASCII.
+        data = data.encode('ascii')
+
+    return data
+
+
+def _certificate(data):
+    """Return the DER encoding of a PEM encoded certificate, if it is one."""
+    match = re.search(
+        b'-----BEGIN CERTIFICATE-----(.*?)-----END CERTIFICATE-----',
+        data, re.DOTALL)
+    if match is None:
+        return None
+
+    return base64.b64decode(match.group(1))
+
+
+def _b64decode(text):
+    """Decode base64 encoded element text; malformed text decodes to None."""
+    try:
+        return base64.b64decode(text or '')
+
+    except (TypeError, ValueError):
+        return None
+
+
+def _der_value(der, offset):
+    """Return the offset and length of the value of the DER item at offset."""
+    length = six.indexbytes(der, offset + 1)
+    offset += 2
+    if length & 0x80:
+        # Long form; the length is encoded in the following bytes.
+        count, length = length & 0x7f, 0
+        for index in range(count):
+            length = (length << 8) | six.indexbytes(der, offset + index)
+
+        offset += count
+
+    return offset, length
+
+
+def _subject_key_identifier(der):
+    """Return the subject key identifier extension of a certificate."""
+    # Find the extension by its object identifier (2.5.29.14).
+    offset = der.find(b'\x06\x03\x55\x1d\x0e')
+    if offset < 0:
+        return None
+
+    # Skip the identifier and the critical flag, if present.
+    offset += 5
+    if der[offset:offset + 1] == b'\x01':
+        offset += 3
+
+    # The value is an OCTET STRING wrapping the identifier OCTET STRING.
+    offset, _ = _der_value(der, offset)
+    offset, length = _der_value(der, offset)
+    return der[offset:offset + length]
+
+
+# Find the elements with a given ID (the same expression is compiled once).
+_find_id = etree.XPath('//*[@ID=$id]')
+
+# Find the references of a <Signature/> node.
+_find_references = etree.XPath(
+    'ds:SignedInfo/ds:Reference/@URI', namespaces={'ds': _DSIG_NS})
+
+
+def _register_ids(ctx, xml, signature_node):
+    """
+    Register the elements referenced by the signature node with the
+    signature context so that `#ID` references resolve.
+
+    The referenced element is almost always the one enveloping the
+    signature; the document is only searched when it is not. Returns
+    `False` when such a search does not find exactly one element.
+    """
+    # Register the document element.
+    if xml.get('ID') is not None:
+        ctx.register_id(xml)
+
+    parent = signature_node.getparent()
+    for uri in _find_references(signature_node):
+        if not uri.startswith('#'):
+            continue
+
+        identifier = uri[1:]
+        if parent is not None and parent.get('ID') == identifier:
+            node = parent
+
+        else:
+            nodes = _find_id(xml, id=identifier)
+            if len(nodes) != 1:
+                # Unknown or ambiguous reference.
+                return False
+
+            node = nodes[0]
+
+        if node is not xml:
+            ctx.register_id(node)
+
+    return True
+
+
+def _remove(node):
+    """Remove a node from its tree, keeping the text that follows it."""
+    parent, previous = node.getparent(), node.getprevious()
+    if node.tail:
+        if previous is not None:
+            previous.tail = (previous.tail or '') + node.tail
+
+        else:
+            parent.text = (parent.text or '') + node.tail
+
+    parent.remove(node)
+
+
+def _check_reference(xml, signature_node, reference):
+    """
+    Compute the digest of the element a <Reference/> refers to and compare
+    it with its <DigestValue/>.
+
+    Returns `None` when the reference uses features that are not
+    understood here; the signature context will decide on those.
+    """
+    # Resolve the referenced element.
+    uri = reference.get('URI') or ''
+    if not uri:
+        # The whole document is referenced; it's digested as its root
+        # element only when there's nothing (e.g. a processing
+        # instruction) around it.
+        target = xml.getroottree().getroot()
+        if target.getprevious() is not None or target.getnext() is not None:
+            return None
+
+    elif uri.startswith('#'):
+        parent = signature_node.getparent()
+        if parent is not None and parent.get('ID') == uri[1:]:
+            target = parent
+
+        else:
+            nodes = _find_id(xml, id=uri[1:])
+            if len(nodes) != 1:
+                return False
+
+            target = nodes[0]
+
+    else:
+        return None
+
+    # Resolve the transforms.
+    enveloped, exclusive, prefixes = False, False, None
+    for transform in reference.iterfind(
+            '{%s}Transforms/{%s}Transform' % (_DSIG_NS, _DSIG_NS)):
+        algorithm = transform.get('Algorithm')
+        if algorithm == _ENVELOPED:
+            enveloped = True
+
+        elif algorithm == _EXCL_C14N:
+            exclusive = True
+            for node in transform:
+                prefixes = (node.get('PrefixList') or '').split()
+
+        elif algorithm != _C14N:
+            return None
 
+    if not exclusive and target.getparent() is not None:
+        # Inclusive canonicalization of a part of the document depends on
+        # the namespaces in scope; leave it to the signature context.
+        return None
 
-def sign(xml, stream, password=None):
+    method = reference.find('{%s}DigestMethod' % _DSIG_NS)
+    value = reference.findtext('{%s}DigestValue' % _DSIG_NS)
+    if method is None or value is None:
+        # Malformed; leave it to the signature context.
+        return None
+
+    name = _DIGESTS.get(method.get('Algorithm'))
+    if name is None:
+        return None
+
+    # Apply the enveloped transform to a copy of the referenced element.
+    if enveloped:
+        path = []
+        node = signature_node
+        while node is not target:
+            parent = node.getparent()
+            if parent is None:
+                # The signature is not enveloped in the element.
+                return None
+
+            path.append(parent.index(node))
+            node = parent
+
+        target = copy.deepcopy(target)
+        node = target
+        for index in reversed(path):
+            node = node[index]
+
+        _remove(node)
+
+    # Canonicalize and digest the element.
+    text = etree.tostring(
+        target, method='c14n', exclusive=exclusive, with_comments=False,
+        inclusive_ns_prefixes=prefixes)
+
+    expected = _b64decode(value)
+    return hashlib.new(name, text).digest() == expected
+
+
+def _check_digests(xml, signature_node):
+    """
+    Check the digest of each reference of a signature before any public
+    key operation; see :func:`_check_reference`.
+    """
+    result = True
+    for reference in signature_node.iterfind(
+            '{%s}SignedInfo/{%s}Reference' % (_DSIG_NS, _DSIG_NS)):
+        checked = _check_reference(xml, signature_node, reference)
+        if checked is False:
+            return False
+
+        if checked is None:
+            result = None
+
+    return result
+
+
+class KeyCache(object):
+    """
+    A bounded, least-recently-used cache of loaded keys.
+
+    Keys are addressed by a hash of their encoded form and password so
+    the same key material is parsed only once no matter how it is
+    passed in. The module-level :data:`key_cache` is used by
+    :func:`sign` and :func:`verify`; it should be cleared with
+    :meth:`clear` when keys are rotated.
+
+    :param int maxsize: The maximum number of keys to keep loaded
+    """
+
+    def __init__(self, maxsize=64):
+        # The maximum number of keys to keep; may be adjusted at any time.
+        self.maxsize = maxsize
+
+        # Counters of cache lookups.
+        self.hits = 0
+        self.misses = 0
+
+        # Loaded keys, ordered from least to most recently used.
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, data, fmt, password=None):
+        """
+        Return the key encoded in `data`, loading it if it's not cached.
+
+        :param bytes data: The encoded key
+        :param int fmt: The `xmlsec.KeyFormat` of the key
+        :param str password: The password used to access the key
+
+        :rtype: xmlsec.Key
+        """
+        import xmlsec
+
+        # Address the key by its content.
+        digest = hashlib.sha256(data)
+        if password is not None:
+            digest.update(b'\0')
+            digest.update(password.encode('utf-8')
+                          if isinstance(password, six.text_type)
+                          else password)
+
+        return self.get(
+            (digest.digest(), fmt),
+            lambda: xmlsec.Key.from_memory(data, fmt, password))
+
+    def get(self, name, factory):
+        """
+        Return the cached value addressed by `name`, producing and caching
+        it with `factory` if it's not cached.
+
+        :param name: The (hashable) address of the value
+        :param callable factory: Produces the value
+        """
+        with self._lock:
+            value = self._keys.pop(name, None)
+            if value is not None:
+                # Mark the value as the most recently used.
+                self._keys[name] = value
+                self.hits += 1
+                return value
+
+            self.misses += 1
+
+        # Produce the value outside of the lock; it's the expensive part.
+        value = factory()
+
+        with self._lock:
+            self._keys[name] = value
+            while len(self._keys) > max(self.maxsize, 0):
+                # Evict the least recently used value.
+                self._keys.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        """Unload all cached keys and reset the counters."""
+        with self._lock:
+            self._keys.clear()
+            self.hits = self.misses = 0
+
+
+# The cache of keys used by `sign` and `verify`.
+key_cache = KeyCache()
+
+# The cache of base64 encoded certificates embedded in signatures.
+certificate_cache = KeyCache()
+
+
+def _encode_certificate(stream):
+    """Return the base64 encoded DER of a certificate, once per certificate."""
+    data = _read(stream)
+
+    def encode():
+        der = _certificate(data)
+        if der is None:
+            raise ValueError('not a certificate', data)
+
+        return base64.b64encode(der).decode('ascii')
+
+    return certificate_cache.get(hashlib.sha256(data).digest(), encode)
+
+
+# Clock for expiring memoized results.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Memo(object):
+    """
+    A bounded, least-recently-used memo of verification results with a
+    time to live.
+
+    Results are addressed by a hash of the exact message bytes and the
+    fingerprint of the keys they were verified with, so byte-identical
+    retries of a message (double submits, retries after a proxy timeout)
+    cost a hash lookup. Whether a repeated message should be accepted
+    at all is a separate (replay) decision.
+
+    :param int maxsize: The maximum number of results to keep
+    :param float ttl: The number of seconds a result is kept
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # Counters of memo lookups.
+        self.hits = 0
+        self.misses = 0
+
+        # Results and their expiry, ordered from least to most recently
+        # used.
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    @staticmethod
+    def _name(data, fingerprint):
+        digest = hashlib.sha256(fingerprint)
+        digest.update(data)
+        return digest.digest()
+
+    def get(self, data, fingerprint):
+        """
+        Return the memoized result of verifying `data`, or `None`.
+
+        :param bytes data: The message
+        :param bytes fingerprint: The fingerprint of the keys
+
+        :rtype: Boolean
+        """
+        name = self._name(data, fingerprint)
+        with self._lock:
+            entry = self._results.pop(name, None)
+            if entry is not None and entry[0] > _clock():
+                # Mark the result as the most recently used.
+                self._results[name] = entry
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+    def set(self, data, fingerprint, result):
+        """
+        Memoize the result of verifying `data`.
+
+        :param bytes data: The message
+        :param bytes fingerprint: The fingerprint of the keys
+        :param bool result: Whether the message is valid
+        """
+        name = self._name(data, fingerprint)
+        with self._lock:
+            self._results.pop(name, None)
+            self._results[name] = (_clock() + self.ttl, result)
+            while len(self._results) > max(self.maxsize, 0):
+                # Evict the least recently used result.
+                self._results.popitem(last=False)
+
+    def clear(self):
+        """Forget all results and reset the counters."""
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = 0
+
+
+def _load(data, fmt, password=None, cache=None):
+    import xmlsec
+
+    if cache is not None:
+        return cache.load(data, fmt, password)
+
+    return xmlsec.Key.from_memory(data, fmt, password)
+
+
+class Signer(object):
+    """
+    Sign XML documents with a private key that is loaded only once.
+
+    Loading (and decrypting) a private key is often more expensive than
+    producing the signature itself; a signer should be constructed once
+    and used to sign any number of documents, from any number of threads.
+
+    :param file stream: The private key to sign documents with
+    :param str password: The password used to access the private key
+    :param KeyCache cache: A cache to load the private key through
+    :param str algorithm: The signature algorithm; one of
+        :data:`SIGNATURE_ALGORITHMS`
+    :param str digest: The digest algorithm; one of
+        :data:`DIGEST_ALGORITHMS`. Defaults to the digest of the signature
+        algorithm.
+    :param file certificate: A certificate to embed in the <KeyInfo> of
+        signatures
+    :param str key_name: A key name to embed in the <KeyInfo> of
+        signatures
+
+    Example usage:
+    ::
+        with open('my_key_file.pem', 'rb') as stream:
+            signer = Signer(stream)
+
+        for document in documents:
+            signer.sign(document.serialize())
+    """
+
+    def __init__(self, stream, password=None, cache=None,
+                 algorithm='rsa-sha1', digest=None, certificate=None,
+                 key_name=None):
+        # Import xmlsec here to delay initializing the C library in
+        # case we don't need it.
+        import xmlsec
+
+        # Resolve the algorithms.
+        if digest is None:
+            digest = algorithm.rsplit('-', 1)[-1]
+
+        self.algorithm = _transform(algorithm, SIGNATURE_ALGORITHMS)
+        self.digest = _transform(digest, DIGEST_ALGORITHMS)
+
+        # Load private key.
+        self.key = _load(
+            _read(stream), xmlsec.KeyFormat.PEM, password, cache)
+
+        # Create a signature template for an enveloped signature; the
+        # template is detached and copied into each signed document.
+        self._template = xmlsec.template.create(
+            etree.Element('Template'),
+            xmlsec.Transform.EXCL_C14N,
+            self.algorithm)
+
+        # Add the <ds:Reference/> node to the signature template.
+        ref = xmlsec.template.add_reference(self._template, self.digest)
+
+        # Add the enveloped transform descriptor.
+        xmlsec.template.add_transform(ref, xmlsec.Transform.ENVELOPED)
+
+        if certificate is not None or key_name is not None:
+            # Add the <ds:KeyInfo/> node to the signature template.
+            key_info = xmlsec.template.ensure_key_info(self._template)
+            if key_name is not None:
+                xmlsec.template.add_key_name(key_info, key_name)
+
+            if certificate is not None:
+                # Embed the encoded certificate as is.
+                x509_data = xmlsec.template.add_x509_data(key_info)
+                node = xmlsec.template.x509_data_add_certificate(x509_data)
+                node.text = _encode_certificate(certificate)
+
+    def sign(self, xml, reference=False):
+        """
+        Sign an XML document. This will add a <Signature> element to the
+        document; see :func:`sign` for the produced output.
+
+        :param lxml.etree._Element xml: The document to sign
+        :param bool reference: Whether to reference the signed element by
+            its ID instead of referencing the whole document; needed for
+            elements that will be embedded in other documents
+
+        :rtype: None
+        """
+        import xmlsec
+
+        # Resolve the SAML/2.0 element in question.
+        from saml.schema.base import _element_registry
+        element = _element_registry.get(xml.tag)
+
+        # Add the <ds:Signature/> node to the document.
+        signature_node = copy.deepcopy(self._template)
+        xml.insert(element.meta.signature_index, signature_node)
+        if reference:
+            # Reference the element by ID and canonicalize it exclusively
+            # so the digest doesn't depend on the enclosing document.
+            ref = signature_node[0].find('{%s}Reference' % _DSIG_NS)
+            ref.set('URI', '#%s' % xml.get('ID'))
+            xmlsec.template.add_transform(ref, xmlsec.Transform.EXCL_C14N)
+
+        # Create a digital signature context (no key manager is needed).
+        # Contexts cannot be reused once they've signed a document.
+        ctx = xmlsec.SignatureContext()
+
+        # Register the ID of the element so `#ID` references resolve.
+        if xml.get('ID') is not None:
+            ctx.register_id(xml)
+
+        # Set the key on the context.
+        ctx.key = self.key
+
+        # Sign the template.
+        ctx.sign(signature_node)
+
+    def sign_binary(self, data):
+        """
+        Sign raw octets, such as the query string of a message sent
+        through the HTTP-Redirect binding.
+
+        :param bytes data: The octets to sign
+
+        :rtype: bytes
+        """
+        import xmlsec
+
+        # Create a digital signature context (no key manager is needed).
+        ctx = xmlsec.SignatureContext()
+        ctx.key = self.key
+
+        # Sign the octets.
+        return ctx.sign_binary(data, self.algorithm)
+
+
+class Verifier(object):
+    """
+    Verify the signature of XML documents with a public key or certificate
+    that is loaded only once.
+
+    The format of the key (a PEM encoded public key or X.509 certificate)
+    is detected when the verifier is constructed.
+
+    When `precheck` is set, the digests of the signed elements are
+    checked before the (much more expensive) public key operation so
+    tampered documents are rejected early. The stage at which documents
+    were rejected is counted in `rejected`.
+
+    :param file stream: The public key or certificate to verify with
+    :param KeyCache cache: A cache to load the key through
+    :param bool precheck: Whether to check the digests first
+    """
+
+    def __init__(self, stream, cache=None, precheck=False):
+        # Whether to check the digests before the signature.
+        self.precheck = precheck
+
+        # Counters of rejected documents, by stage.
+        self.rejected = {'digest': 0, 'signature': 0}
+
+        # Import xmlsec here to delay initializing the C library in
+        # case we don't need it.
+        import xmlsec
+
+        # Detect the format of the key from its PEM armor.
+        self._data = data = _read(stream)
+        self.fingerprint = hashlib.sha256(data).digest()
+        fmt = xmlsec.KeyFormat.PEM
+        if b'-----BEGIN CERTIFICATE-----' in data:
+            fmt = xmlsec.KeyFormat.CERT_PEM
+
+        # Load the public key.
+        self.key = _load(data, fmt, cache=cache)
+
+    def __reduce__(self):
+        # Loaded keys cannot be pickled; send the encoded key instead.
+        return (Verifier, (self._data, None, self.precheck))
+
+    def verify(self, xml):
+        """
+        Verify the signature of an XML document; see :func:`verify`.
+
+        :param lxml.etree._Element xml: The document to verify
+
+        :rtype: Boolean
+        """
+        import xmlsec
+
+        # Find the <Signature/> node.
+        signature_node = xmlsec.tree.find_node(xml, xmlsec.Node.SIGNATURE)
+        if signature_node is None:
+            # No `signature` node found; we cannot verify
+            return False
+
+        # Create a digital signature context (no key manager is needed).
+        ctx = xmlsec.SignatureContext()
+
+        # Register the IDs of the referenced elements.
+        if not _register_ids(ctx, xml, signature_node):
+            return False
+
+        # Check the digests of the referenced elements.
+        if self.precheck and _check_digests(xml, signature_node) is False:
+            self.rejected['digest'] += 1
+            return False
+
+        # Set the key on the context.
+        ctx.key = self.key
+
+        # Verify the signature.
+        try:
+            ctx.verify(signature_node)
+
+            return True
+
+        except Exception:
+            self.rejected['signature'] += 1
+            return False
+
+    def verify_binary(self, data, algorithm, signature):
+        """
+        Verify the signature of raw octets, such as the query string of a
+        message received through the HTTP-Redirect binding.
+
+        :param bytes data: The signed octets
+        :param str algorithm: The URI of the signature algorithm
+        :param bytes signature: The signature
+
+        :rtype: Boolean
+        """
+        import xmlsec
+
+        transform = _algorithm(algorithm)
+        if transform is None:
+            # Unknown or unsupported signature algorithm.
+            return False
+
+        # Create a digital signature context (no key manager is needed).
+        ctx = xmlsec.SignatureContext()
+        ctx.key = self.key
+
+        # Verify the signature.
+        try:
+            ctx.verify_binary(data, transform, signature)
+
+            return True
+
+        except Exception:
+            return False
+
+    def verify_element(self, node):
+        """
+        Verify the signature enveloped in a specific element; see
+        :func:`verify_element`.
+
+        :param lxml.etree._Element node: The signed element
+
+        :rtype: str
+        """
+        import xmlsec
+
+        # Find the <Signature/> node of this element.
+        signature_node = node.find('{%s}Signature' % _DSIG_NS)
+        if signature_node is None:
+            # No `signature` node found; we cannot verify
+            return None
+
+        # The signature must cover this element (and only this element).
+        references = signature_node.findall(
+            '{%s}SignedInfo/{%s}Reference' % (_DSIG_NS, _DSIG_NS))
+        if len(references) != 1:
+            return None
+
+        identifier = node.get('ID')
+        uri = references[0].get('URI')
+        if uri and uri != '#%s' % identifier:
+            return None
+
+        if not uri and node.getparent() is not None:
+            # The signature covers the whole document; verify a copy of the
+            # element as a document of its own.
+            node = copy.deepcopy(node)
+            signature_node = node.find('{%s}Signature' % _DSIG_NS)
+
+        # Create a digital signature context (no key manager is needed).
+        ctx = xmlsec.SignatureContext()
+        if identifier is not None:
+            ctx.register_id(node)
+
+        # Set the key on the context.
+        ctx.key = self.key
+
+        # Verify the signature.
+        try:
+            ctx.verify(signature_node)
+
+            return identifier or ''
+
+        except Exception:
+            return None
+
+
+def sign(xml, stream, password=None, algorithm='rsa-sha1', digest=None,
+         certificate=None, key_name=None):
     """
     Sign an XML document with the given private key file. This will add a
     <Signature> element to the document.
@@ -16,6 +838,15 @@ def sign(xml, stream, password=None):
     :param lxml.etree._Element xml: The document to sign
     :param file stream: The private key to sign the document with
     :param str password: The password used to access the private key
+    :param str algorithm: The signature algorithm; one of
+        :data:`SIGNATURE_ALGORITHMS`
+    :param str digest: The digest algorithm; one of
+        :data:`DIGEST_ALGORITHMS`. Defaults to the digest of the signature
+        algorithm.
+    :param file certificate: A certificate to embed in the <KeyInfo> of
+        the signature so receivers can select the key to verify with
+    :param str key_name: A key name to embed in the <KeyInfo> of the
+        signature
 
     :rtype: None
 
@@ -73,94 +904,208 @@ def sign(xml, stream, password=None):
         </samlp:AuthnRequest>
     """
 
-    # Import xmlsec here to delay initializing the C library in
-    # case we don't need it.
-    import xmlsec
+    # Load the key and sign the document.
+    Signer(stream, password, key_cache, algorithm, digest, certificate,
+           key_name).sign(xml)
+
 
-    # Resolve the SAML/2.0 element in question.
-    from saml.schema.base import _element_registry
-    element = _element_registry.get(xml.tag)
+def verify(xml, stream):
+    """
+    Verify the signaure of an XML document with the given certificate.
+    The signature and digest algorithms are read from the signature.
+    Returns `True` if the document is signed with a valid signature.
+    Returns `False` if the document is not signed or if the signature is
+    invalid.
 
-    # Create a signature template for RSA-SHA1 enveloped signature.
-    signature_node = xmlsec.template.create(
-        xml,
-        xmlsec.Transform.EXCL_C14N,
-        xmlsec.Transform.RSA_SHA1)
+    :param lxml.etree._Element xml: The document to sign
+    :param file stream: The private key to sign the document with
 
-    # Add the <ds:Signature/> node to the document.
-    xml.insert(element.meta.signature_index, signature_node)
+    :rtype: Boolean
+    """
+    # Load the key and verify the document.
+    return Verifier(stream, cache=key_cache).verify(xml)
 
-    # Add the <ds:Reference/> node to the signature template.
-    ref = xmlsec.template.add_reference(
-        signature_node, xmlsec.Transform.SHA1)
 
-    # Add the enveloped transform descriptor.
-    xmlsec.template.add_transform(ref, xmlsec.Transform.ENVELOPED)
+def verify_element(node, stream):
+    """
+    Verify the signature enveloped in a specific element, such as one
+    <Assertion> of a <Response>, with the given certificate. Only that
+    element is canonicalized and digested.
 
-    # Create a digital signature context (no key manager is needed).
-    ctx = xmlsec.SignatureContext()
+    Returns the ID of the element the signature covers if it is valid.
+    Returns `None` if the element is not signed, if its signature does not
+    cover exactly that element or if the signature is invalid.
 
-    # Load private key.
-    key = xmlsec.Key.from_memory(stream, xmlsec.KeyFormat.PEM, password)
+    :param lxml.etree._Element node: The signed element
+    :param file stream: The public key or certificate to verify with
 
-    # Set the key on the context.
-    ctx.key = key
+    :rtype: str
 
-    # Sign the template.
-    ctx.sign(signature_node)
+    Example usage:
+    ::
+        for assertion in response.iterfind('{%s}Assertion' % ns):
+            if verify_element(assertion, stream) is None:
+                raise ValueError('assertion is not signed')
+    """
+    # Load the key and verify the element.
+    return Verifier(stream, cache=key_cache).verify_element(node)
 
 
-def verify(xml, stream):
+class TrustStore(object):
     """
-    Verify the signaure of an XML document with the given certificate.
-    Returns `True` if the document is signed with a valid signature.
-    Returns `False` if the document is not signed or if the signature is
-    invalid.
+    Verify the signature of XML documents against a set of trusted
+    certificates, such as the old and new certificate of an identity
+    provider during key rollover.
 
-    :param lxml.etree._Element xml: The document to sign
-    :param file stream: The private key to sign the document with
+    Certificates are indexed by their SHA-256 fingerprint and by their
+    subject key identifier. The key to verify with is selected from the
+    `<ds:KeyInfo/>` of the signature; each candidate is only tried in
+    turn when the signature does not identify a trusted certificate.
 
-    :rtype: Boolean
+    When `precheck` is set, the digests are checked once before any
+    public key operation; see :class:`Verifier`.
+
+    :param list certificates: The trusted certificates (or public keys)
+    :param KeyCache cache: A cache to load the keys through
+    :param bool precheck: Whether to check the digests first
     """
-    # Import xmlsec here to delay initializing the C library in
-    # case we don't need it.
-    import xmlsec
 
-    # Find the <Signature/> node.
-    signature_node = xmlsec.tree.find_node(xml, xmlsec.Node.SIGNATURE)
-    if signature_node is None:
-        # No `signature` node found; we cannot verify
-        return False
+    def __init__(self, certificates, cache=None, precheck=False):
+        # Whether to check the digests before the signature.
+        self.precheck = precheck
 
-    # Create a digital signature context (no key manager is needed).
-    ctx = xmlsec.SignatureContext()
+        # Counters of rejected documents, by stage.
+        self.rejected = {'digest': 0, 'signature': 0}
 
-    # Register <Response/> and <Assertion/>
-    ctx.register_id(xml)
-    for assertion in xml.xpath("//*[local-name()='Assertion']"):
-        ctx.register_id(assertion)
+        # The verifiers of all trusted certificates, in the given order.
+        self.verifiers = []
 
-    # Load the public key.
-    key = None
-    for fmt in [
-            xmlsec.KeyFormat.PEM,
-            xmlsec.KeyFormat.CERT_PEM]:
-        stream.seek(0)
-        try:
-            key = xmlsec.Key.from_memory(stream, fmt)
-            break
-        except ValueError:  
-            # xmlsec now throws when it can't load the key
-            pass
+        # The verifiers indexed by fingerprint and subject key identifier.
+        self._index = {}
 
-    # Set the key on the context.
-    ctx.key = key
+        # The fingerprint of all trusted keys.
+        fingerprint = hashlib.sha256()
 
-    # Verify the signature.
-    try:
-        ctx.verify(signature_node)
+        for stream in certificates:
+            data = _read(stream)
+            verifier = Verifier(data, cache=cache)
+            self.verifiers.append(verifier)
+            fingerprint.update(verifier.fingerprint)
+
+            der = _certificate(data)
+            if der is not None:
+                digest = hashlib.sha256(der).digest()
+                self._index[('sha256', digest)] = verifier
+
+                identifier = _subject_key_identifier(der)
+                if identifier:
+                    self._index[('ski', identifier)] = verifier
+
+        self.fingerprint = fingerprint.digest()
+
+    def __reduce__(self):
+        # Loaded keys cannot be pickled; send the encoded keys instead.
+        data = [verifier._data for verifier in self.verifiers]
+        return (TrustStore, (data, None, self.precheck))
+
+    def select(self, signature_node):
+        """
+        Return the trusted verifier identified by the `<ds:KeyInfo/>` of
+        the signature node, if any.
+
+        :param lxml.etree._Element signature_node: The <Signature> node
+
+        :rtype: Verifier
+        """
+        namespaces = {'ds': _DSIG_NS}
+        data = signature_node.find('ds:KeyInfo/ds:X509Data', namespaces)
+        if data is None:
+            return None
+
+        names = []
+        for node in data.iterfind('ds:X509Certificate', namespaces):
+            der = _b64decode(node.text)
+            if der:
+                names.append(('sha256', hashlib.sha256(der).digest()))
+
+        for node in data.iterfind('ds:X509SKI', namespaces):
+            names.append(('ski', _b64decode(node.text)))
 
-        return True
+        for name in names:
+            verifier = self._index.get(name)
+            if verifier is not None:
+                return verifier
 
-    except Exception:
+    def verify(self, xml):
+        """
+        Verify the signature of an XML document; see :func:`verify`.
+
+        :param lxml.etree._Element xml: The document to verify
+
+        :rtype: Boolean
+        """
+        import xmlsec
+
+        # Find the <Signature/> node.
+        signature_node = xmlsec.tree.find_node(xml, xmlsec.Node.SIGNATURE)
+        if signature_node is None:
+            # No `signature` node found; we cannot verify
+            return False
+
+        # Check the digests of the referenced elements.
+        if self.precheck and _check_digests(xml, signature_node) is False:
+            self.rejected['digest'] += 1
+            return False
+
+        # Verify with the identified certificate or fall back to trying
+        # each trusted certificate.
+        for verifier in self._candidates(signature_node):
+            if verifier.verify(xml):
+                return True
+
+        self.rejected['signature'] += 1
         return False
+
+    def verify_binary(self, data, algorithm, signature):
+        """
+        Verify the signature of raw octets with each trusted certificate;
+        see :meth:`Verifier.verify_binary`.
+
+        :param bytes data: The signed octets
+        :param str algorithm: The URI of the signature algorithm
+        :param bytes signature: The signature
+
+        :rtype: Boolean
+        """
+        for verifier in self.verifiers:
+            if verifier.verify_binary(data, algorithm, signature):
+                return True
+
+        return False
+
+    def verify_element(self, node):
+        """
+        Verify the signature enveloped in a specific element; see
+        :func:`verify_element`.
+
+        :param lxml.etree._Element node: The signed element
+
+        :rtype: str
+        """
+        # Find the <Signature/> node of this element.
+        signature_node = node.find('{%s}Signature' % _DSIG_NS)
+        if signature_node is None:
+            # No `signature` node found; we cannot verify
+            return None
+
+        for verifier in self._candidates(signature_node):
+            identifier = verifier.verify_element(node)
+            if identifier is not None:
+                return identifier
+
+    def _candidates(self, signature_node):
+        verifier = self.select(signature_node)
+        if verifier is not None:
+            return [verifier]
+
+        return self.verifiers
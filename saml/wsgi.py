@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Serve the SAML endpoints of an entity from a WSGI application.
+
+The middleware handles requests to the assertion consumer service (ACS),
+single logout (SLO) and metadata endpoints and passes any other request
+to the wrapped application. Messages received at the ACS and SLO
+endpoints are received with :func:`saml.client.receive_message` and
+passed to a handler that builds the response:
+::
+    from saml import signature, wsgi
+
+    def handler(endpoint, received, environ):
+        # `endpoint` is 'acs' or 'slo'; `received` is a
+        # `saml.client.Received`.
+        return '303 See Other', [('Location', '/')], b''
+
+    application = wsgi.Middleware(
+        application, handler,
+        trust=signature.Verifier(open('idp.pem', 'rb')),
+        metadata=open('metadata.xml', 'rb').read())
+
+.. autoclass:: Middleware
+    :members:
+"""
+import zlib
+from lxml import etree
+from saml import client
+
+# The default maximum size of a request body; room for an encoded message
+# of the largest size received and the other parameters of the bindings.
+MAX_BODY_SIZE = client.MAX_ENCODED_SIZE + 16 * 1024
+
+# The media type of SAML metadata.
+_METADATA_TYPE = 'application/samlmetadata+xml'
+
+
+def _response(status, body=b'', content_type='text/plain; charset=utf-8'):
+    return status, [('Content-Type', content_type),
+                    ('Content-Length', str(len(body)))], body
+
+
+class _Endpoints(object):
+    """
+    Route requests to the SAML endpoints and process them; shared by the
+    WSGI and ASGI middleware.
+    """
+
+    def __init__(self, app, handler, trust=None, memo=None, metadata=None,
+                 acs='/saml/acs', slo='/saml/slo',
+                 metadata_path='/saml/metadata', max_body_size=None,
+                 resolver=None):
+        self.app = app
+        self.handler = handler
+        self.trust = trust
+        self.memo = memo
+        self.metadata = metadata
+        self.resolver = resolver
+        self.max_body_size = (
+            MAX_BODY_SIZE if max_body_size is None else max_body_size)
+
+        self._routes = {acs: 'acs', slo: 'slo'}
+        if metadata is not None:
+            self._routes[metadata_path] = 'metadata'
+
+    def route(self, path):
+        """Return the endpoint served at a path, or `None`."""
+        return self._routes.get(path)
+
+    def serve_metadata(self):
+        """Build the response of the metadata endpoint."""
+        metadata = self.metadata
+        if callable(metadata):
+            metadata = metadata()
+
+        if not isinstance(metadata, bytes):
+            metadata = etree.tostring(
+                metadata, xml_declaration=True, encoding='utf-8')
+
+        return _response('200 OK', metadata, _METADATA_TYPE)
+
+    def process(self, endpoint, method, query_string, body, request):
+        """
+        Receive a message at the ACS or SLO endpoint and hand it to the
+        handler; returns the status, headers and body of the response.
+        """
+        try:
+            received = client.receive_message(
+                method, query_string, body, self.trust, self.memo,
+                resolver=self.resolver)
+
+        except client.MessageTooLarge:
+            return _response('413 Payload Too Large')
+
+        except (ValueError, zlib.error, etree.XMLSyntaxError):
+            received = None
+
+        if received is None or received.message is None:
+            return _response('400 Bad Request')
+
+        if self.trust is not None and not received.verified:
+            # Only trusted messages are handled.
+            return _response('400 Bad Request')
+
+        return self.handler(endpoint, received, request)
+
+
+class Middleware(_Endpoints):
+    """
+    WSGI middleware serving the SAML endpoints of an entity.
+
+    The handler is called with the endpoint (`'acs'` or `'slo'`), the
+    :class:`saml.client.Received` message and the WSGI environment and
+    returns the status, headers and body of the response. Requests with
+    no (trusted) message get a `400` response and bodies larger than
+    `max_body_size` bytes a `413` response, without being read.
+
+    :param app: The wrapped WSGI application
+    :param handler: Builds the responses of the ACS and SLO endpoints
+    :param trust: A :class:`saml.signature.Verifier` (or
+        :class:`saml.signature.TrustStore`) messages must be signed by
+    :param saml.signature.Memo memo: Memoizes verified signatures
+    :param metadata: The metadata served at `metadata_path`, as bytes or
+        an element (or a callable returning either); the endpoint is not
+        mounted when there is none
+    :param str acs: The path of the ACS endpoint
+    :param str slo: The path of the SLO endpoint
+    :param str metadata_path: The path of the metadata endpoint
+    :param int max_body_size: The maximum size of request bodies;
+        :data:`MAX_BODY_SIZE` by default
+    :param saml.artifact.Resolver resolver: Resolves artifacts
+    """
+
+    def __call__(self, environ, start_response):
+        endpoint = self.route(environ.get('PATH_INFO') or '/')
+        if endpoint is None:
+            # Not one of ours.
+            return self.app(environ, start_response)
+
+        method = environ['REQUEST_METHOD']
+        if endpoint == 'metadata':
+            if method not in ('GET', 'HEAD'):
+                status, headers, body = _response('405 Method Not Allowed')
+
+            else:
+                status, headers, body = self.serve_metadata()
+
+            start_response(status, headers)
+            return [body]
+
+        # Read the body, unless it's too large.
+        body = b''
+        if method == 'POST':
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+
+            except ValueError:
+                length = 0
+
+            if length > self.max_body_size:
+                status, headers, body = _response('413 Payload Too Large')
+                start_response(status, headers)
+                return [body]
+
+            body = environ['wsgi.input'].read(length) if length else b''
+
+        status, headers, body = self.process(
+            endpoint, method, environ.get('QUERY_STRING', ''), body, environ)
+
+        start_response(status, headers)
+        return [body]
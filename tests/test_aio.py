@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+from saml import aio, signature
+from test_schema import BASE_DIR, assert_node
+from test_signature import build, read
+from lxml import etree
+from os import path
+from pytest import raises
+
+
+def test_async_sign_and_verify():
+    executor = aio.Executor(workers=2, queue_size=2)
+    filename = path.join(BASE_DIR, 'response-signed.xml')
+    expected = etree.parse(filename).getroot()
+
+    async def run():
+        document = build('response').serialize()
+        await aio.async_sign(document, read('rsakey.pem'), executor=executor)
+        assert_node(expected, document)
+
+        verifier = signature.Verifier(read('rsacert.pem'))
+        results = await asyncio.gather(*[
+            aio.async_verify(document, verifier, executor=executor)
+            for _ in range(8)])
+
+        return results
+
+    assert asyncio.run(run()) == [True] * 8
+    assert executor.completed == 9
+    assert executor.pending == 0
+    assert executor.queued_time >= 0
+    assert executor.run_time > 0
+    executor.shutdown()
+
+
+def test_executor_queue_full():
+    executor = aio.Executor(workers=1, queue_size=1)
+    event = threading.Event()
+
+    async def run():
+        blocked = [asyncio.ensure_future(executor.run(event.wait))
+                   for _ in range(2)]
+        await asyncio.sleep(0)
+
+        with raises(asyncio.QueueFull):
+            await executor.run(event.wait, wait=False)
+
+        event.set()
+        await asyncio.gather(*blocked)
+
+    asyncio.run(run())
+    assert executor.completed == 2
+    executor.shutdown()
+
+
+def test_executor_event_loops():
+    executor = aio.Executor(workers=1, queue_size=0)
+
+    async def run():
+        return await asyncio.gather(*[
+            executor.run(time.sleep, 0.01) for _ in range(3)])
+
+    # The executor can be used (and waited on) from several event loops.
+    assert asyncio.run(run()) == [None] * 3
+    assert asyncio.run(run()) == [None] * 3
+    assert executor.completed == 6
+    executor.shutdown()
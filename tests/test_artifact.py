@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import threading
+from contextlib import contextmanager
+from saml import artifact, client, signature
+from test_schema import build_response_simple
+from test_signature import read
+from six.moves import BaseHTTPServer
+from six.moves.urllib.parse import quote_plus, urlencode
+from pytest import raises
+
+ENTITY_ID = 'https://idp.example.org/SAML2'
+
+
+@contextmanager
+def serve(store, **kwargs):
+    connections = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            connections.append(self.client_address)
+            BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            data = store.respond(body, **kwargs)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%d/SAML2/ArtifactResolution' % (
+            server.server_address[1]), connections
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_create():
+    text = artifact.create(ENTITY_ID, 1, b'x' * 20)
+    data = base64.b64decode(text)
+    assert data[:4] == b'\x00\x04\x00\x01'
+    assert data[4:24] == hashlib.sha1(ENTITY_ID.encode('utf-8')).digest()
+    assert data[24:] == b'x' * 20
+    assert artifact.parse(text) == (1, data[4:24], b'x' * 20)
+
+    # Handles are random.
+    assert artifact.create(ENTITY_ID) != artifact.create(ENTITY_ID)
+
+    with raises(ValueError):
+        artifact.parse(base64.b64encode(b'\x00\x02' + data[2:]))
+
+    with raises(ValueError):
+        artifact.parse('AAQ')
+
+
+def test_store(monkeypatch):
+    store = artifact.Store(ENTITY_ID, ttl=60)
+    target = build_response_simple()
+    text = store.issue(target.serialize())
+
+    # Messages are resolved once.
+    assert store.take(text).get('ID') == target.id
+    assert store.take(text) is None
+
+    # Nor after they expire.
+    now = artifact._clock()
+    text = store.issue(target.serialize())
+    monkeypatch.setattr(artifact, '_clock', lambda: now + 61)
+    assert store.take(text) is None
+
+    # Nor when issued by another entity.
+    other = artifact.Store('https://other.example.org/SAML2')
+    assert store.take(other.issue(target.serialize())) is None
+
+
+def test_memory_backend():
+    backend = artifact.MemoryBackend(maxsize=2)
+    store = artifact.Store(ENTITY_ID, backend=backend)
+    target = build_response_simple().serialize()
+    texts = [store.issue(target) for _ in range(3)]
+    assert len(backend) == 2
+
+    # The oldest message was dropped.
+    assert store.take(texts[0]) is None
+    assert store.take(texts[2]) is not None
+
+
+def test_resolve():
+    store = artifact.Store(ENTITY_ID)
+    target = build_response_simple()
+    with serve(store) as (uri, connections):
+        resolver = artifact.Resolver(
+            {ENTITY_ID: uri}, issuer='https://sp.example.com/SAML2')
+        texts = [store.issue(target.serialize()) for _ in range(3)]
+        for text in texts:
+            message = resolver.resolve(text)
+            assert message.get('ID') == target.id
+            assert message.getparent() is None
+
+        # Connections are kept alive.
+        assert len(connections) == 1
+
+        # Artifacts are resolved once.
+        assert resolver.resolve(texts[0]) is None
+
+        # Unknown identity providers are not contacted.
+        other = artifact.Store('https://other.example.org/SAML2')
+        assert resolver.resolve(other.issue(target.serialize())) is None
+        assert resolver.resolve('AAQ') is None
+
+        # Nor are unknown endpoints.
+        text = artifact.create(ENTITY_ID, 1)
+        assert resolver.resolve(text) is None
+        assert len(connections) == 1
+        resolver.close()
+
+
+def test_resolve_signed():
+    store = artifact.Store(ENTITY_ID)
+    target = build_response_simple()
+    idp = signature.Signer(read('rsakey.pem'))
+    sp = signature.Signer(read('rsa2key.pem'))
+    kwargs = {'signer': idp, 'trust': signature.Verifier(read('rsa2cert.pem'))}
+    with serve(store, **kwargs) as (uri, _):
+        resolver = artifact.Resolver(
+            {ENTITY_ID: uri}, signer=sp,
+            trust=signature.Verifier(read('rsacert.pem')))
+        assert resolver.resolve(store.issue(target.serialize())) is not None
+
+        # Responses signed by another key are rejected.
+        resolver.trust = signature.Verifier(read('rsa2cert.pem'))
+        assert resolver.resolve(store.issue(target.serialize())) is None
+
+        # Unsigned requests are refused.
+        resolver.signer = None
+        resolver.trust = None
+        text = store.issue(target.serialize())
+        assert resolver.resolve(text) is None
+        resolver.close()
+
+
+def test_receive():
+    store = artifact.Store(ENTITY_ID)
+    target = build_response_simple()
+    with serve(store) as (uri, _):
+        resolver = artifact.Resolver({ENTITY_ID: uri})
+        query = urlencode([
+            ('SAMLArtifact', store.issue(target.serialize())),
+            ('RelayState', 'http://localhost:8080/?a=b')])
+
+        # Nothing is resolved without a resolver.
+        assert client.receive('GET', query, None) is None
+
+        message, relay_state = client.receive(
+            'GET', query, None, resolver=resolver)
+        assert message.get('ID') == target.id
+        assert relay_state == 'http://localhost:8080/?a=b'
+
+        # The relay state is decoded as for the other bindings.
+        query = 'SAMLArtifact=%s&RelayState=a%%2525b' % quote_plus(
+            store.issue(target.serialize()))
+        _, relay_state = client.receive('GET', query, None, resolver=resolver)
+        redirect, _ = client.send('http://localhost', target.serialize())
+        _, expected = client.receive(
+            'GET', redirect.split('?')[1] + '&RelayState=a%2525b', None)
+        assert relay_state == expected == 'a%25b'
+        resolver.close()
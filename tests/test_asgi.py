@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from saml import aio, asgi, signature
+from test_signature import read
+from test_wsgi import METADATA, handler, signed_body
+
+
+async def application(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': []})
+    await send({'type': 'http.response.body', 'body': b'application'})
+
+
+def request(app, path, method='GET', query=b'', body=b'', chunk=None,
+            headers=()):
+    # Send the body in chunks of `chunk` bytes.
+    chunk = chunk or len(body) or 1
+    events = [{'type': 'http.request', 'body': body[i:i + chunk],
+               'more_body': i + chunk < len(body)}
+              for i in range(0, max(len(body), 1), chunk)]
+    received = []
+    sent = []
+
+    async def receive():
+        received.append(events[len(received)])
+        return received[-1]
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'path': path, 'method': method,
+             'query_string': query, 'headers': list(headers)}
+    asyncio.run(app(scope, receive, send))
+
+    return sent[0]['status'], sent[1]['body'], len(received)
+
+
+def build_app(**kwargs):
+    kwargs.setdefault('trust', signature.Verifier(read('rsacert.pem')))
+    return asgi.Middleware(application, handler, metadata=METADATA, **kwargs)
+
+
+def test_acs():
+    executor = aio.Executor(workers=1)
+    app = build_app(executor=executor)
+    status, body, _ = request(
+        app, '/saml/acs', 'POST', body=signed_body(), chunk=1024)
+    assert status == 200
+    assert body == b'acs identifier_2 state'
+    assert executor.completed == 1
+    executor.shutdown()
+
+    status, _, _ = request(build_app(), '/saml/acs', 'POST', body=b'a=b')
+    assert status == 400
+
+
+def test_metadata():
+    status, body, _ = request(build_app(), '/saml/metadata')
+    assert (status, body) == (200, METADATA)
+
+
+def test_max_body_size():
+    app = build_app(max_body_size=2048)
+
+    # Reading stops as soon as the body is too large.
+    status, _, chunks = request(
+        app, '/saml/acs', 'POST', body=signed_body(), chunk=1024)
+    assert status == 413
+    assert chunks == 3
+
+    # Bodies announced as too large aren't read.
+    body = signed_body()
+    status, _, chunks = request(
+        app, '/saml/acs', 'POST', body=body,
+        headers=[(b'content-length', str(len(body)).encode('ascii'))])
+    assert (status, chunks) == (413, 0)
+
+
+def test_pass_through():
+    _, body, _ = request(build_app(), '/')
+    assert body == b'application'
@@ -0,0 +1,95 @@
+import pickle
+import saml
+from saml import batch, signature
+from test_schema import BASE_DIR, NAMES, assert_node
+from test_signature import build, read
+from lxml import etree
+from os import path
+from pytest import mark, raises
+
+
+@mark.parametrize('workers', [1, 2])
+def test_sign_many(workers):
+    documents = [build(name) for name in NAMES]
+
+    # Documents may be given already serialized.
+    documents[0] = documents[0].serialize()
+
+    result = saml.sign_many(documents, read('rsakey.pem'), workers=workers)
+    assert isinstance(result, batch.Batch)
+    assert len(result) == len(NAMES)
+    assert result.rate > 0
+
+    for name, signed in zip(NAMES, result):
+        filename = path.join(BASE_DIR, '%s-signed.xml' % name)
+        expected = etree.parse(filename).getroot()
+        assert_node(expected, etree.XML(signed))
+
+
+def test_sign_many_parse():
+    documents = [build('response'), build('assertion')]
+    result = saml.sign_many(
+        documents, read('rsakey.pem'), workers=1, parse=True)
+
+    for document in result:
+        assert saml.verify(document, read('rsacert.pem'))
+
+
+@mark.parametrize('workers,threads', [(1, False), (2, False), (2, True)])
+def test_verify_many(workers, threads):
+    trust = signature.TrustStore([read('rsacert.pem'), read('rsa2cert.pem')])
+
+    messages = []
+    for name in NAMES:
+        filename = path.join(BASE_DIR, '%s-signed.xml' % name)
+        messages.append(etree.parse(filename).getroot())
+
+        filename = path.join(BASE_DIR, '%s-simple.xml' % name)
+        messages.append(read(filename))
+
+    result = saml.verify_many(
+        iter(messages), trust, workers=workers, threads=threads, window=3)
+    result = sorted(result)
+
+    assert [index for index, _ in result] == list(range(len(messages)))
+    assert [ok for _, ok in result] == [True, False] * len(NAMES)
+
+
+def test_verifier_pickle():
+    verifier = signature.Verifier(read('rsacert.pem'))
+    document = etree.parse(path.join(BASE_DIR, 'response-signed.xml'))
+
+    assert pickle.loads(pickle.dumps(verifier)).verify(document.getroot())
+
+
+def test_verify_many_window():
+    trust = signature.Verifier(read('rsacert.pem'))
+    message = read(path.join(BASE_DIR, 'response-signed.xml'))
+    consumed = []
+
+    def messages():
+        for index in range(20):
+            consumed.append(index)
+            yield message
+
+    results = []
+    for result in saml.verify_many(
+            messages(), trust, workers=2, threads=True, window=3):
+        # No more than the window is in flight at once.
+        assert len(consumed) - len(results) <= 3
+        results.append(result)
+
+    assert sorted(results) == [(index, True) for index in range(20)]
+
+
+class Broken(object):
+    def verify(self, message):
+        raise ValueError('broken')
+
+
+@mark.parametrize('threads', [False, True])
+def test_verify_many_error(threads):
+    # Errors of the workers are raised in the calling process.
+    with raises(ValueError):
+        list(saml.verify_many([b'<a/>'] * 4, Broken(), workers=2,
+                              threads=threads))
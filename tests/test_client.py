@@ -1,6 +1,13 @@
-from saml import client
-from test_schema import build_authentication_request_simple
-from six.moves.urllib.parse import quote_plus
+import base64
+import zlib
+from lxml import etree
+from saml import client, schema, signature
+from test_schema import BASE_DIR, build_authentication_request_simple
+from test_schema import build_assertion_simple, build_response_simple
+from test_signature import read
+from six.moves.urllib.parse import quote_plus, urlencode
+from os import path
+from pytest import mark, raises
 
 
 def test_relay_state():
@@ -10,3 +17,347 @@ def test_relay_state():
 
     relay_state_part = 'RelayState=%s' % quote_plus(state)
     assert relay_state_part in uri
+
+
+def test_redirect_round_trip():
+    target = build_authentication_request_simple()
+    state = 'http://localhost:8080/?a=b'
+    uri, _ = client.send('http://localhost', target.serialize(), state)
+
+    query_string = uri.split('?', 1)[1]
+    message, relay_state = client.receive('GET', query_string, None)
+    assert message.get('ID') == target.id
+    assert relay_state == state
+
+
+@mark.parametrize('protocol', ['redirect', 'post', 'simplesign'])
+def test_relay_state_round_trip(protocol):
+    target = build_response_simple()
+    state = 'a+b x%41y %25&c=d'
+    signer = signature.Signer(read('rsakey.pem'))
+    trust = signature.Verifier(read('rsacert.pem'))
+    uri, fields = client.send(
+        'http://localhost', target.serialize(), state, protocol, signer)
+
+    if protocol == 'redirect':
+        _, relay_state = client.receive('GET', uri.split('?', 1)[1], None,
+                                        trust)
+
+    else:
+        if protocol == 'post':
+            fields = [(field.get('name'), field.get('value'))
+                      for field in etree.HTML(fields).iterfind('.//input')
+                      if field.get('type') == 'hidden']
+
+        _, relay_state = client.receive('POST', None, urlencode(fields),
+                                        trust)
+
+    assert relay_state == state
+
+
+def test_redirect_signature():
+    target = build_authentication_request_simple()
+    state = 'http://localhost:8080/'
+    signer = signature.Signer(read('rsakey.pem'), algorithm='rsa-sha256')
+    uri, _ = client.send(
+        'http://localhost', target.serialize(), state, signer=signer)
+
+    query_string = uri.split('?', 1)[1]
+    assert '&SigAlg=' in query_string
+    assert '&Signature=' in query_string
+
+    trust = signature.TrustStore([read('rsa2cert.pem'), read('rsacert.pem')])
+    message, relay_state = client.receive('GET', query_string, None, trust)
+    assert message.get('ID') == target.id
+    assert relay_state == state
+
+    # Tampering with any signed parameter is detected.
+    tampered = query_string.replace('RelayState=http', 'RelayState=https')
+    assert client.receive('GET', tampered, None, trust) is None
+
+    # Unsigned messages are not accepted when a signature is required.
+    unsigned = query_string.split('&SigAlg=')[0]
+    assert client.receive('GET', unsigned, None, trust) is None
+    assert client.receive('GET', unsigned, None) is not None
+
+    # Nor are messages signed with an untrusted key.
+    trust = signature.Verifier(read('rsa2cert.pem'))
+    assert client.receive('GET', query_string, None, trust) is None
+
+
+def test_simplesign_round_trip():
+    target = build_response_simple()
+    state = 'http://localhost:8080/?a=b'
+    signer = signature.Signer(read('ecdsakey.pem'), algorithm='ecdsa-sha256')
+    uri, fields = client.send(
+        'http://localhost', target.serialize(), state, 'simplesign', signer)
+
+    assert uri == 'http://localhost'
+    assert [name for name, _ in fields] == [
+        'SAMLResponse', 'RelayState', 'SigAlg', 'Signature']
+
+    body = urlencode(fields)
+    trust = signature.Verifier(read('ecdsacert.pem'))
+    message, relay_state = client.receive('POST', None, body, trust)
+    assert message.get('ID') == target.id
+    assert relay_state == state
+
+    # Tampering with any signed field is detected.
+    fields[1] = ('RelayState', 'http://evil/')
+    assert client.receive('POST', None, urlencode(fields), trust) is None
+
+    # A signer is required.
+    with raises(ValueError):
+        client.send('http://localhost', target.serialize(), state,
+                    'simplesign')
+
+
+def test_post_form():
+    target = build_response_simple()
+    state = 'http://localhost:8080/?a=b&c="<d>"'
+    uri, form = client.send(
+        'http://localhost/?a=b&c=d', target.serialize(), state, 'post')
+
+    assert uri == 'http://localhost/?a=b&c=d'
+    assert 'action="http://localhost/?a=b&amp;c=d"' in form
+
+    # The form posts the message and the relay state as they were.
+    page = etree.HTML(form)
+    assert page.find('.//form').get('action') == uri
+    fields = [(field.get('name'), field.get('value'))
+              for field in page.iterfind('.//input[@type="hidden"]')]
+    assert [name for name, _ in fields] == ['SAMLResponse', 'RelayState']
+
+    message, relay_state = client.receive('POST', None, urlencode(fields))
+    assert message.get('ID') == target.id
+    assert relay_state == state
+
+    # The same form as bytes.
+    _, data = client.send(
+        'http://localhost/?a=b&c=d', target.serialize(), state, 'post',
+        binary=True)
+    assert data == form.encode('utf-8')
+
+    # Signed messages carry an enveloped signature.
+    signer = signature.Signer(read('rsakey.pem'))
+    xml = target.serialize()
+    _, form = client.send('http://localhost', xml, None, 'post', signer)
+    assert len(xml) == len(target.serialize())
+
+    fields = [(field.get('name'), field.get('value'))
+              for field in etree.HTML(form).iterfind('.//input')
+              if field.get('type') == 'hidden']
+    assert [name for name, _ in fields] == ['SAMLResponse']
+
+    trust = signature.Verifier(read('rsacert.pem'))
+    message, _ = client.receive('POST', None, urlencode(fields), trust)
+    assert message.get('ID') == target.id
+
+
+def build_wrapped():
+    # A forged (unsigned) response with a genuine signed assertion wrapped
+    # in its extensions.
+    genuine = build_assertion_simple().sign(
+        signature.Signer(read('rsakey.pem')))
+
+    xml = build_response_simple().serialize()
+    forged = xml.find(schema.Assertion.name)
+    forged.set('ID', 'evil')
+    extensions = etree.Element(
+        '{%s}Extensions' % schema.Response.meta.namespace[1])
+    extensions.append(genuine)
+    xml.insert(1, extensions)
+    return urlencode([('SAMLResponse', base64.b64encode(
+        etree.tostring(xml)))])
+
+
+def test_post_wrapped():
+    body = build_wrapped()
+    trust = signature.Verifier(read('rsacert.pem'))
+    assert client.receive('POST', None, body, trust) is None
+    assert client.receive_message('POST', None, body, trust) is None
+
+    # Responses with signed assertions are trusted.
+    target = build_response_simple()
+    target.assertions[0].sign(signature.Signer(read('rsakey.pem')))
+    body = urlencode([('SAMLResponse', base64.b64encode(target.tostring()))])
+    received = client.receive_message('POST', None, body, trust)
+    assert received.verified
+    assert received.message.assertions[0].id == target.assertions[0].id
+
+
+def test_post_memo():
+    with open(path.join(BASE_DIR, 'response-signed.xml'), 'rb') as stream:
+        text = stream.read()
+
+    body = urlencode([('SAMLResponse', base64.b64encode(text))])
+    trust = signature.Verifier(read('rsacert.pem'))
+    memo = signature.Memo()
+    for _ in range(3):
+        message, _ = client.receive('POST', None, body, trust, memo)
+        assert message.get('ID') == 'identifier_2'
+
+    assert (memo.hits, memo.misses) == (2, 1)
+
+    # The memo is specific to the trusted keys.
+    trust = signature.Verifier(read('rsa2cert.pem'))
+    assert client.receive('POST', None, body, trust, memo) is None
+    assert client.receive('POST', None, body, trust, memo) is None
+    assert (memo.hits, memo.misses) == (3, 2)
+
+
+@mark.parametrize('kind', [bytes, bytearray, memoryview, 'text'])
+def test_receive_buffers(kind):
+    def convert(text):
+        if kind == 'text':
+            return text
+
+        return kind(text.encode('ascii'))
+
+    target = build_response_simple()
+    state = 'http://localhost:8080/?a=b'
+    uri, _ = client.send('http://localhost', target.serialize(), state)
+    query_string = uri.split('?', 1)[1]
+
+    message, relay_state = client.receive('GET', convert(query_string), None)
+    assert message.get('ID') == target.id
+    assert relay_state == state
+
+    body = urlencode([('SAMLResponse', base64.b64encode(target.tostring())),
+                      ('RelayState', state)])
+    message, relay_state = client.receive('POST', None, convert(body))
+    assert message.get('ID') == target.id
+    assert relay_state == state
+
+
+def test_parameters():
+    data = memoryview(b'a=1&SAMLResponse=PD94%2B&xRelayState=no'
+                      b'&RelayState=a+b&SAMLResponse=second&SigAlg=')
+    parameters = client._parameters(data)
+
+    assert sorted(parameters) == ['RelayState', 'SAMLResponse', 'SigAlg']
+    assert isinstance(parameters['SAMLResponse'], memoryview)
+    assert bytes(parameters['SAMLResponse']) == b'PD94%2B'
+    assert bytes(parameters['RelayState']) == b'a+b'
+    assert bytes(parameters['SigAlg']) == b''
+
+    assert client._unquote(parameters['SAMLResponse']) == b'PD94+'
+    assert client._unquote(parameters['RelayState']) == b'a b'
+
+
+def test_receive_max_size():
+    # A small request that inflates to a large message.
+    text = zlib.compress(b'<a>' + b' ' * (1024 * 1024) + b'</a>')[2:-4]
+    query_string = urlencode([('SAMLRequest', base64.b64encode(text))])
+    assert len(query_string) < 4096
+
+    with raises(client.MessageTooLarge):
+        client.receive('GET', query_string, None, max_size=64 * 1024)
+
+    message, _ = client.receive('GET', query_string, None)
+    assert message.tag == 'a'
+
+    with raises(client.MessageTooLarge):
+        client.receive('GET', query_string, None, max_encoded_size=1024)
+
+    body = urlencode([('SAMLResponse', base64.b64encode(b'<a/>' * 64))])
+    with raises(client.MessageTooLarge):
+        client.receive('POST', None, body, max_size=128)
+
+
+def test_receive_message():
+    with open(path.join(BASE_DIR, 'response-signed.xml'), 'rb') as stream:
+        text = stream.read()
+
+    body = urlencode([('SAMLResponse', base64.b64encode(text)),
+                      ('RelayState', 'state')])
+    trust = signature.Verifier(read('rsacert.pem'))
+    received = client.receive_message('POST', None, body, trust)
+    assert isinstance(received.message, schema.Response)
+    assert received.message.id == 'identifier_2'
+    assert received.relay_state == 'state'
+    assert received.binding == 'post'
+    assert received.verified
+    assert list(received.timings) == [
+        'binding', 'decode', 'parse', 'status', 'verify', 'deserialize']
+
+    # Messages that aren't trusted are not returned.
+    trust = signature.Verifier(read('rsa2cert.pem'))
+    assert client.receive_message('POST', None, body, trust) is None
+
+    # Unsuccessful responses are rejected, never let through unverified.
+    target = build_response_simple()
+    target.status.code.value = schema.StatusCode.REQUESTER
+    body = urlencode([('SAMLResponse', base64.b64encode(target.tostring()))])
+    trust = signature.Verifier(read('rsacert.pem'))
+    assert client.receive_message('POST', None, body, trust) is None
+
+    # Unless they are signed.
+    target.status.code.value = schema.StatusCode.AUTHENTICATION_FAILED
+    xml = target.serialize()
+    xml.remove(xml.find(schema.Assertion.name))
+    signature.Signer(read('rsakey.pem')).sign(xml)
+    received = client.receive_message('POST', None, urlencode([
+        ('SAMLResponse', base64.b64encode(etree.tostring(xml)))]), trust)
+    assert received.verified
+    assert received.message.status.code.value == (
+        schema.StatusCode.AUTHENTICATION_FAILED)
+
+    # Without trust, they're returned (not verified).
+    received = client.receive_message('POST', None, body)
+    assert received.message.status.code.value == schema.StatusCode.REQUESTER
+    assert not received.verified
+
+    # Nothing is verified without trust.
+    uri, _ = client.send('http://localhost', target.serialize())
+    received = client.receive_message('GET', uri.split('?')[1], None)
+    assert isinstance(received.message, schema.Response)
+    assert received.binding == 'redirect'
+    assert not received.verified
+
+
+def test_peek():
+    target = build_response_simple()
+    uri, _ = client.send('http://localhost', target.serialize(), 'state')
+    peeked = client.peek('GET', uri.split('?')[1], None)
+    assert peeked == client.Peek(
+        'redirect', schema.Response.name, target.id, target.issuer.text,
+        target.destination, target.in_response_to, 'state')
+
+    # Messages are decoded and parsed only as far as needed.
+    body = urlencode([('SAMLResponse', base64.b64encode(
+        target.tostring() + b'<'))])
+    peeked = client.peek('POST', None, body)
+    assert peeked.binding == 'post'
+    assert peeked.issuer == target.issuer.text
+
+    # Messages without an issuer.
+    target = build_authentication_request_simple()
+    del target.issuer
+    body = urlencode([('SAMLRequest', base64.b64encode(target.tostring()))])
+    peeked = client.peek('POST', None, body)
+    assert peeked.tag == schema.AuthenticationRequest.name
+    assert peeked.id == target.id
+    assert peeked.issuer is None
+
+    # Only the relay state of artifacts is known.
+    peeked = client.peek('GET', 'SAMLArtifact=AAQ&RelayState=a%20b', None)
+    assert peeked == client.Peek(
+        'artifact', None, None, None, None, None, 'a b')
+
+    # Small messages are parsed whole.
+    query = urlencode([('SAMLRequest', base64.b64encode(
+        zlib.compress(b'<a/>')[2:-4]))])
+    peeked = client.peek('GET', query, None)
+    assert peeked == client.Peek(
+        'redirect', 'a', None, None, None, None, None)
+
+    # The relay state is decoded as when received.
+    query += '&RelayState=a%2525b'
+    assert client.peek('GET', query, None).relay_state == 'a%25b'
+    assert client.receive('GET', query, None)[1] == 'a%25b'
+
+    assert client.peek('GET', 'a=b', None) is None
+    assert client.peek('PUT', None, None) is None
+    with raises(client.MessageTooLarge):
+        client.peek('POST', None, body, max_encoded_size=64)
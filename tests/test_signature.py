@@ -0,0 +1,385 @@
+import base64
+from saml import signature
+from test_schema import BASE_DIR, NAMES, assert_node
+import test_schema
+from lxml import etree
+from os import path
+from pytest import mark, raises
+
+
+def build(name):
+    build_fn_name = ('build-%s-simple' % name).replace('-', '_')
+    return getattr(test_schema, build_fn_name)()
+
+
+@mark.parametrize('name', NAMES)
+def test_signer(name):
+    filename = path.join(BASE_DIR, '%s-signed.xml' % name)
+    expected = etree.parse(filename).getroot()
+
+    with open(path.join(BASE_DIR, 'rsakey.pem'), 'rb') as stream:
+        signer = signature.Signer(stream)
+
+    # The same signer is used for several documents.
+    for _ in range(2):
+        result = build(name).serialize()
+        signer.sign(result)
+
+        assert_node(expected, result)
+
+
+@mark.parametrize('filename', ['rsapub.pem', 'rsacert.pem'])
+def test_verifier(filename):
+    with open(path.join(BASE_DIR, filename), 'rb') as stream:
+        verifier = signature.Verifier(stream)
+
+    for name in NAMES:
+        signed = path.join(BASE_DIR, '%s-signed.xml' % name)
+        assert verifier.verify(etree.parse(signed).getroot())
+
+        simple = path.join(BASE_DIR, '%s-simple.xml' % name)
+        assert verifier.verify(etree.parse(simple).getroot()) is False
+
+
+def test_key_cache():
+    cache = signature.KeyCache(maxsize=1)
+    with open(path.join(BASE_DIR, 'rsakey.pem'), 'rb') as stream:
+        private = stream.read()
+
+    with open(path.join(BASE_DIR, 'rsacert.pem'), 'rb') as stream:
+        public = stream.read()
+
+    key = signature.Signer(private, cache=cache).key
+    assert signature.Signer(private, cache=cache).key is key
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Loading another key evicts the least recently used one.
+    signature.Verifier(public, cache=cache)
+    assert len(cache) == 1
+    assert signature.Signer(private, cache=cache).key is not key
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_sign_and_verify_use_key_cache():
+    signature.key_cache.clear()
+    document = build('response').serialize()
+    for _ in range(2):
+        with open(path.join(BASE_DIR, 'rsacert.pem'), 'r') as stream:
+            signature.verify(document, stream)
+
+    assert signature.key_cache.hits == 1
+    assert signature.key_cache.misses == 1
+
+
+def test_reuse_stream():
+    # Keys are read from the start of streams that were read before.
+    document = build('response').serialize()
+    with open(path.join(BASE_DIR, 'rsakey.pem'), 'rb') as stream:
+        signature.Signer(stream)
+        signature.Signer(stream, cache=signature.KeyCache()).sign(document)
+
+    with open(path.join(BASE_DIR, 'rsacert.pem'), 'rb') as stream:
+        for _ in range(2):
+            verifier = signature.Verifier(stream, cache=signature.KeyCache())
+            assert verifier.verify(document)
+
+
+def read(filename):
+    with open(path.join(BASE_DIR, filename), 'rb') as stream:
+        return stream.read()
+
+
+def add_x509_data(xml, name, text):
+    signature_node = xml.find('{%s}Signature' % signature._DSIG_NS)
+    key_info = etree.SubElement(
+        signature_node, '{%s}KeyInfo' % signature._DSIG_NS)
+    data = etree.SubElement(key_info, '{%s}X509Data' % signature._DSIG_NS)
+    etree.SubElement(data, '{%s}%s' % (signature._DSIG_NS, name)).text = text
+
+
+def test_trust_store_fallback():
+    trust = signature.TrustStore([read('rsacert.pem'), read('rsa2cert.pem')])
+    for key, expected in [('rsakey.pem', True), ('rsa2key.pem', True)]:
+        document = build('response').serialize()
+        signature.Signer(read(key)).sign(document)
+        assert trust.verify(document) is expected
+
+    trust = signature.TrustStore([read('rsacert.pem')])
+    document = build('response').serialize()
+    signature.Signer(read('rsa2key.pem')).sign(document)
+    assert trust.verify(document) is False
+
+
+@mark.parametrize('name,text', [
+    ('X509Certificate', lambda der: base64.b64encode(der)),
+    ('X509SKI', lambda der: base64.b64encode(
+        signature._subject_key_identifier(der))),
+])
+def test_trust_store_select(name, text):
+    trust = signature.TrustStore([read('rsacert.pem'), read('rsa2cert.pem')])
+    der = signature._certificate(read('rsa2cert.pem'))
+
+    document = build('response').serialize()
+    signature.Signer(read('rsa2key.pem')).sign(document)
+    add_x509_data(document, name, text(der).decode('ascii'))
+
+    signature_node = document.find('{%s}Signature' % signature._DSIG_NS)
+    assert trust.select(signature_node) is trust.verifiers[1]
+    assert trust.verify(document)
+
+
+def test_trust_store_select_unknown():
+    trust = signature.TrustStore([read('rsacert.pem')])
+    document = build('response').serialize()
+    signature.Signer(read('rsakey.pem')).sign(document)
+    add_x509_data(document, 'X509Certificate', 'bm90IGEgY2VydA==')
+
+    signature_node = document.find('{%s}Signature' % signature._DSIG_NS)
+    assert trust.select(signature_node) is None
+    assert trust.verify(document)
+
+
+def test_verify_id_reference():
+    # Sign the assertion alone, referencing it by ID.
+    response = build('response').serialize()
+    assertion = response[-1]
+    signer = signature.Signer(read('rsakey.pem'))
+    signer._template.find(
+        './/{%s}Reference' % signature._DSIG_NS).set('URI', '#identifier_3')
+    signer.sign(assertion)
+
+    verifier = signature.Verifier(read('rsacert.pem'))
+    assert verifier.verify(response)
+
+    # References resolving to several elements are rejected.
+    reference = assertion.find('.//{%s}Reference' % signature._DSIG_NS)
+    reference.set('URI', '#identifier_2')
+    response.append(etree.Element('Other', ID='identifier_2'))
+    assert verifier.verify(response) is False
+
+
+def test_verify_element():
+    # Sign an assertion on its own and wrap it in an unsigned response.
+    assertion = build('assertion').serialize()
+    signature.Signer(read('rsakey.pem')).sign(assertion)
+    response = build('response').serialize()
+    response.replace(response[-1], assertion)
+
+    verifier = signature.Verifier(read('rsacert.pem'))
+    identifier = 'b07b804c-7c29-ea16-7300-4f3d6f7928ac'
+    assert verifier.verify_element(response[-1]) == identifier
+    assert signature.verify_element(response[-1], read('rsapub.pem')) == (
+        identifier)
+
+    # The response itself is not signed.
+    assert verifier.verify_element(response) is None
+
+    # Tampering with the assertion is detected.
+    response[-1].set('IssueInstant', '2004-12-05T09:22:06Z')
+    assert verifier.verify_element(response[-1]) is None
+
+
+def test_verify_element_reference():
+    filename = path.join(BASE_DIR, 'response-signed.xml')
+    response = etree.parse(filename).getroot()
+    trust = signature.TrustStore([read('rsa2cert.pem'), read('rsacert.pem')])
+    assert trust.verify_element(response) == 'identifier_2'
+
+    # A signature referencing another element is not accepted.
+    reference = response.find('.//{%s}Reference' % signature._DSIG_NS)
+    reference.set('URI', '#identifier_3')
+    assert trust.verify_element(response) is None
+
+
+@mark.parametrize('algorithm,key,certificate', [
+    ('rsa-sha256', 'rsakey.pem', 'rsacert.pem'),
+    ('rsa-sha384', 'rsakey.pem', 'rsacert.pem'),
+    ('rsa-sha512', 'rsa2key.pem', 'rsa2cert.pem'),
+    ('ecdsa-sha256', 'ecdsakey.pem', 'ecdsacert.pem'),
+    ('ecdsa-sha384', 'ecdsakey.pem', 'ecdsacert.pem'),
+])
+def test_sign_algorithm(algorithm, key, certificate):
+    document = build('response').serialize()
+    signature.sign(document, read(key), algorithm=algorithm)
+
+    method = document.find('.//{%s}SignatureMethod' % signature._DSIG_NS)
+    digest = document.find('.//{%s}DigestMethod' % signature._DSIG_NS)
+    assert method.get('Algorithm').endswith(algorithm)
+    assert digest.get('Algorithm').endswith(algorithm.split('-')[-1])
+
+    assert signature.verify(document, read(certificate))
+
+    other = 'rsacert.pem' if key != 'rsakey.pem' else 'rsa2cert.pem'
+    assert signature.verify(document, read(other)) is False
+
+
+def test_sign_digest():
+    document = build('response').serialize()
+    signer = signature.Signer(
+        read('rsakey.pem'), algorithm='rsa-sha256', digest='sha512')
+    signer.sign(document)
+
+    digest = document.find('.//{%s}DigestMethod' % signature._DSIG_NS)
+    assert digest.get('Algorithm').endswith('sha512')
+    assert signature.verify(document, read('rsacert.pem'))
+
+
+def test_sign_unknown_algorithm():
+    with raises(ValueError):
+        signature.Signer(read('rsakey.pem'), algorithm='rsa-md5')
+
+
+def test_presigned_assertion():
+    signer = signature.Signer(read('rsakey.pem'))
+    assertion = build('assertion')
+    signed = etree.tostring(
+        assertion.sign(signer), method='c14n', exclusive=True)
+
+    verifier = signature.Verifier(read('rsacert.pem'))
+    identifier = 'b07b804c-7c29-ea16-7300-4f3d6f7928ac'
+    for response_id in ['identifier_2', 'identifier_4']:
+        target = build('response')
+        target.id = response_id
+        del target.assertions
+        target.assertions = assertion
+
+        # Changes after signing are not serialized.
+        assertion.issuer = 'https://idp.example.org/other'
+
+        response = target.serialize()
+        assert etree.tostring(
+            response[-1], method='c14n', exclusive=True) == signed
+        assert verifier.verify(response)
+        assert verifier.verify_element(response[-1]) == identifier
+
+        # The envelope may be signed as well.
+        signer.sign(response)
+        assert verifier.verify_element(response) == response_id
+        assert verifier.verify_element(response[-1]) == identifier
+
+
+def test_memo(monkeypatch):
+    memo = signature.Memo(maxsize=2, ttl=10)
+    now = [100.0]
+    monkeypatch.setattr(signature, '_clock', lambda: now[0])
+
+    memo.set(b'a', b'key', True)
+    memo.set(b'b', b'key', False)
+    assert memo.get(b'a', b'key') is True
+    assert memo.get(b'b', b'key') is False
+    assert memo.get(b'a', b'other') is None
+    assert (memo.hits, memo.misses) == (2, 1)
+
+    # The least recently used result is evicted.
+    memo.get(b'a', b'key')
+    memo.set(b'c', b'key', True)
+    assert len(memo) == 2
+    assert memo.get(b'b', b'key') is None
+
+    # Results expire.
+    now[0] += 11
+    assert memo.get(b'a', b'key') is None
+
+    memo.clear()
+    assert len(memo) == 0
+    assert (memo.hits, memo.misses) == (0, 0)
+
+
+@mark.parametrize('name', NAMES)
+def test_check_digests(name):
+    filename = path.join(BASE_DIR, '%s-signed.xml' % name)
+    document = etree.parse(filename).getroot()
+    signature_node = document.find('{%s}Signature' % signature._DSIG_NS)
+    assert signature._check_digests(document, signature_node) is True
+
+    document.set('ID', 'tampered')
+    assert signature._check_digests(document, signature_node) is False
+
+
+def test_check_digests_reference():
+    # Exclusively canonicalized elements referenced by ID.
+    response = build('response').serialize()
+    signer = signature.Signer(read('rsakey.pem'), algorithm='rsa-sha256')
+    signer.sign(response[-1], reference=True)
+
+    signature_node = response[-1].find('{%s}Signature' % signature._DSIG_NS)
+    assert signature._check_digests(response, signature_node) is True
+
+    response[-1][0].text = 'https://idp.example.org/other'
+    assert signature._check_digests(response, signature_node) is False
+
+
+@mark.parametrize('cls,key', [
+    (signature.Verifier, read('rsacert.pem')),
+    (signature.TrustStore, [read('rsa2cert.pem'), read('rsacert.pem')]),
+])
+def test_precheck(cls, key):
+    verifier = cls(key, precheck=True)
+    filename = path.join(BASE_DIR, 'response-signed.xml')
+    assert verifier.verify(etree.parse(filename).getroot())
+
+    # Tampered documents are rejected by their digest.
+    document = etree.parse(filename).getroot()
+    document.set('Destination', 'https://evil.example.com/')
+    assert verifier.verify(document) is False
+    assert verifier.rejected == {'digest': 1, 'signature': 0}
+
+    # Forged signatures are rejected by the signature check.
+    document = etree.parse(filename).getroot()
+    value = document.find('.//{%s}SignatureValue' % signature._DSIG_NS)
+    value.text = 'A' + value.text[1:]
+    assert verifier.verify(document) is False
+    assert verifier.rejected == {'digest': 1, 'signature': 1}
+
+
+@mark.parametrize('cls,key', [
+    (signature.Verifier, read('rsacert.pem')),
+    (signature.TrustStore, [read('rsacert.pem')]),
+])
+def test_precheck_malformed(cls, key):
+    verifier = cls(key, precheck=True)
+    filename = path.join(BASE_DIR, 'response-signed.xml')
+
+    # References without a digest method are left to the signature check.
+    document = etree.parse(filename).getroot()
+    method = document.find('.//{%s}DigestMethod' % signature._DSIG_NS)
+    method.getparent().remove(method)
+    assert verifier.verify(document) is False
+
+    # Whole documents with processing instructions around their root
+    # element are digested by the signature check.
+    document = build('response').serialize()
+    document = etree.fromstring(b'<?foo bar?>' + etree.tostring(document))
+    signature.sign(document, read('rsakey.pem'))
+    assert signature.verify(document, read('rsacert.pem'))
+    assert verifier.verify(document)
+
+
+def test_sign_key_info():
+    signature.certificate_cache.clear()
+    trust = signature.TrustStore([read('rsacert.pem'), read('rsa2cert.pem')])
+    for _ in range(2):
+        document = build('response').serialize()
+        signature.sign(document, read('rsa2key.pem'),
+                       certificate=read('rsa2cert.pem'), key_name='idp-2')
+
+        signature_node = document.find('{%s}Signature' % signature._DSIG_NS)
+        key_info = signature_node.find('{%s}KeyInfo' % signature._DSIG_NS)
+        assert key_info.findtext(
+            '{%s}KeyName' % signature._DSIG_NS) == 'idp-2'
+
+        assert trust.select(signature_node) is trust.verifiers[1]
+        assert trust.verify(document)
+
+    # The certificate was encoded once.
+    assert signature.certificate_cache.misses == 1
+    assert signature.certificate_cache.hits == 1
+
+
+def test_sign_key_info_not_certificate():
+    with raises(ValueError):
+        signature.Signer(read('rsakey.pem'), certificate=read('rsapub.pem'))
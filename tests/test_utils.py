@@ -1,3 +1,5 @@
+import threading
+from lxml import etree
 from saml.schema import utils
 
 
@@ -32,3 +34,30 @@ class TestPascalize:
         text = 'Some_thing'
 
         assert utils.pascalize(text) == 'SomeThing'
+
+
+class TestFromString:
+
+    def test_parse(self):
+        xml = utils.fromstring(b'<a>\n  <b/><!-- comment -->\n</a>')
+
+        assert xml.tag == 'a'
+        assert [child.tag for child in xml] == ['b']
+        assert xml.text == '\n  '
+
+    def test_entities(self):
+        text = (b'<!DOCTYPE a [<!ENTITY e SYSTEM "file:///etc/passwd">]>'
+                b'<a>&e;</a>')
+        xml = utils.fromstring(text)
+
+        assert 'root' not in etree.tostring(xml).decode()
+
+    def test_thread(self):
+        parsers = []
+        thread = threading.Thread(
+            target=lambda: parsers.append(utils.parser()))
+        thread.start()
+        thread.join()
+
+        assert utils.parser() is utils.parser()
+        assert parsers[0] is not utils.parser()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import base64
+import zlib
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+from saml import client, schema, signature, wsgi
+from test_schema import BASE_DIR, build_authentication_request_simple
+from test_schema import build_response_simple
+from test_signature import read
+from test_client import build_wrapped
+from six.moves.urllib.parse import urlencode
+from os import path
+
+METADATA = b'<EntityDescriptor/>'
+
+
+def application(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'application']
+
+
+def handler(endpoint, received, environ):
+    body = ('%s %s %s' % (endpoint, received.message.id,
+                          received.relay_state)).encode('utf-8')
+    return '200 OK', [('Content-Type', 'text/plain')], body
+
+
+def request(app, path, method='GET', query='', body=b''):
+    environ = {
+        'PATH_INFO': path,
+        'REQUEST_METHOD': method,
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+
+    response = {}
+
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+
+    response['body'] = b''.join(app(environ, start_response))
+    return response
+
+
+def signed_body():
+    with open(path.join(BASE_DIR, 'response-signed.xml'), 'rb') as stream:
+        text = stream.read()
+
+    return urlencode([('SAMLResponse', base64.b64encode(text)),
+                      ('RelayState', 'state')]).encode('ascii')
+
+
+def build_app(**kwargs):
+    kwargs.setdefault('trust', signature.Verifier(read('rsacert.pem')))
+    return wsgi.Middleware(application, handler, metadata=METADATA, **kwargs)
+
+
+def test_acs():
+    app = build_app()
+    response = request(app, '/saml/acs', 'POST', body=signed_body())
+    assert response['status'] == '200 OK'
+    assert response['body'] == b'acs identifier_2 state'
+
+    # Messages that aren't trusted are refused.
+    app.trust = signature.Verifier(read('rsa2cert.pem'))
+    response = request(app, '/saml/acs', 'POST', body=signed_body())
+    assert response['status'] == '400 Bad Request'
+
+    response = request(app, '/saml/acs', 'POST', body=b'a=b')
+    assert response['status'] == '400 Bad Request'
+
+    # Unsigned messages are refused too, whatever their status.
+    target = build_response_simple()
+    target.status.code.value = schema.StatusCode.REQUESTER
+    body = urlencode([('SAMLResponse', base64.b64encode(target.tostring()))])
+    response = request(app, '/saml/acs', 'POST', body=body.encode('ascii'))
+    assert response['status'] == '400 Bad Request'
+
+    uri, _ = client.send('http://localhost', target.serialize())
+    response = request(app, '/saml/acs', query=uri.split('?')[1])
+    assert response['status'] == '400 Bad Request'
+
+
+def test_wrapped():
+    # A forged response wrapping a genuine signed assertion is refused.
+    app = build_app()
+    response = request(
+        app, '/saml/acs', 'POST', body=build_wrapped().encode('ascii'))
+    assert response['status'] == '400 Bad Request'
+
+
+def test_malformed():
+    app = build_app(trust=None)
+
+    # Data that doesn't inflate.
+    query = urlencode([('SAMLRequest', base64.b64encode(b'\xff\xfe\xfd\xfc'))])
+    response = request(app, '/saml/slo', query=query)
+    assert response['status'] == '400 Bad Request'
+
+    # Data that doesn't parse.
+    query = urlencode([('SAMLRequest', base64.b64encode(
+        zlib.compress(b'<a>')[2:-4]))])
+    response = request(app, '/saml/slo', query=query)
+    assert response['status'] == '400 Bad Request'
+
+
+def test_slo():
+    app = build_app(trust=None)
+    target = build_authentication_request_simple()
+    uri, _ = client.send('http://localhost', target.serialize(), 'state')
+    response = request(app, '/saml/slo', query=uri.split('?')[1])
+    assert response['status'] == '200 OK'
+    assert response['body'] == (
+        'slo %s state' % target.id).encode('utf-8')
+
+
+def test_metadata():
+    app = build_app()
+    response = request(app, '/saml/metadata')
+    assert response['status'] == '200 OK'
+    assert response['headers']['Content-Type'] == (
+        'application/samlmetadata+xml')
+    assert response['body'] == METADATA
+
+    response = request(app, '/saml/metadata', 'POST')
+    assert response['status'] == '405 Method Not Allowed'
+
+
+def test_max_body_size():
+    app = build_app(max_body_size=1024)
+    response = request(app, '/saml/acs', 'POST', body=signed_body())
+    assert response['status'] == '413 Payload Too Large'
+
+
+def test_pass_through():
+    response = request(build_app(), '/')
+    assert response['body'] == b'application'